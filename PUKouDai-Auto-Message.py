@@ -1,12 +1,31 @@
 import os
+import sys
 import requests
 import json
+import argparse
+import contextlib
+import functools
+import inspect
+import threading
 import datetime
 import time
 import base64
+import gzip
+import zlib
 import random
+import heapq
+import bisect
 import re
-from typing import Dict, List, Any, Optional, Set, Tuple
+import sqlite3
+import socket
+import marshal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional, Set, Tuple, Iterable, Iterator, Union
+
+try:
+    import orjson  # 可选依赖：pip install orjson，未安装时使用标准库 json
+except ImportError:
+    orjson = None
 
 # ==============================================================================
 # 1. 基础配置与鉴权 (Basic Config & Auth)
@@ -41,9 +60,20 @@ FILTER_KEYWORDS = []
 
 LARGE_ACT_CAPACITY_LIMIT = 700   # 大型活动判定：人数上限
 LARGE_ACT_DURATION_DAYS = 10     # 大型活动判定：持续天数
+LARGE_ACT_FORCE_ALL = True       # 公共活动一律按大型活动限流 (关闭后按上面两个门槛判定)
 MAX_LARGE_DETAIL_COUNT = 3       # 大型活动：详细通知上限次数
 LARGE_NOTIFY_BATCH = 80          # 大型活动：简略通知积攒人数阈值
 
+# 字段变更提醒：这些字段的哈希值记录在 _state["field_hashes"] 中，
+# 哈希变化即视为字段变更 (无需保存或比较完整旧记录)
+CHANGE_NOTIFY_FIELDS = [
+    "joinStartTime", "joinEndTime",   # 报名时间
+    "startTime", "endTime",           # 活动时间
+    "statusName",                     # 活动状态
+    "allowUserCount",                 # 名额
+    "attachName", "attachTitle",      # 附件
+]
+
 # 数据存储路径 (指定绝对路径)
 DATA_FILE = "./pu_monitor_cache.json"
 
@@ -71,6 +101,11 @@ REMIND_WINDOW_MIN = 30
 REQUEST_TIMEOUT = 8
 # 网络请求最大重试次数
 MAX_RETRIES = 2
+# 社团与公共同时到期时合并运行：共用一个按活动 ID 去重的详情请求队列
+UNIFIED_RUN = True
+# 每日运行窗口 (窗口外脚本休眠，摘要消息顺延到早上第一次推送)
+RUN_WINDOW_START = datetime.time(7, 30)
+RUN_WINDOW_END = datetime.time(22, 0)
 
 # ==============================================================================
 # 9. 数据清洗配置 (Data Cleaning Config)
@@ -102,6 +137,137 @@ REQUIRED_FIELDS = [
     "creatorName",          # 创建人/主办者
 ]
 
+# ==============================================================================
+# 10. 摘要推送配置 (Digest Scheduler)
+# ==============================================================================
+# 是否开启摘要模式 (关闭时每次运行产生的消息立即打包推送)
+DIGEST_ENABLED = False
+# 摘要推送间隔 (分钟)：距上次推送超过该间隔才会发送积攒的消息
+DIGEST_INTERVAL_MIN = 120
+# 体积预算：积攒条数或总字数达到上限时提前推送
+DIGEST_MAX_ITEMS = 15
+DIGEST_MAX_CHARS = 6000
+# 紧急消息类型 (不进入摘要，立即推送)
+# 可选: "tribe_new" 社团新活动 / "tribe_delta" 社团人数变动 / "public" 公共活动 / "field_change" 字段变更
+# 另外：报名将在 REMIND_WINDOW_MIN 分钟内截止的活动也视为紧急
+DIGEST_URGENT_KINDS = []
+
+# ==============================================================================
+# 11. 性能追踪配置 (Tracing & Profiling)
+# ==============================================================================
+# 是否默认开启阶段追踪 (也可通过命令行 --trace 临时开启)
+TRACE_ENABLED = False
+# 追踪结果输出路径 (Chrome/Perfetto trace-event JSON，可在 chrome://tracing 或 ui.perfetto.dev 打开)
+TRACE_FILE = "./pu_trace.json"
+# --profile 模式下 cProfile 统计输出路径 (按累计耗时排序的文本)
+PROFILE_FILE = "./pu_profile.txt"
+
+# ==============================================================================
+# 12. 多用户订阅配置 (Subscriptions)
+# ==============================================================================
+# 是否开启多用户订阅：公共活动详情只请求一次，再按每个订阅者的画像分发
+SUBSCRIPTION_ENABLED = False
+# 订阅者列表文件 (JSON 数组)，每项格式:
+# {"id": "alice", "allow_years": [...], "college_id": 123, "filter_keywords": ["不加分"], "push_url": "http://..."}
+# push_url 为空时该订阅者的消息输出到控制台
+SUBSCRIBERS_FILE = "./pu_subscribers.json"
+# 订阅者各自的 _state 存储文件 (与主缓存分开，避免主缓存随订阅者数量膨胀；KV 后端时存于 KV)
+SUBSCRIPTION_STATE_FILE = "./pu_subscriber_state.json"
+
+# ==============================================================================
+# 13. 本地活动索引配置 (Activity Store)
+# ==============================================================================
+# 每次运行把清洗后的活动写入本地 SQLite (FTS5 全文索引)，供 query 子命令离线查询
+ACTIVITY_STORE_ENABLED = True
+ACTIVITY_STORE_FILE = "./pu_activity_store.db"
+
+# ==============================================================================
+# 14. 归档配置 (Archive)
+# ==============================================================================
+# 活动结束或从列表中消失时，将最终记录与 _state 历史追加到压缩归档，主缓存只保留活跃活动
+ARCHIVE_ENABLED = True
+# 归档目录 (gzip 压缩的 NDJSON 分段 + index.json 偏移索引)
+ARCHIVE_DIR = "./pu_archive"
+# 单个分段的压缩后体积上限 (字节)，超过后新建分段
+ARCHIVE_SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+# 每个活动 _state 中保留的报名人数历史点数上限 (仅人数变化时记录)
+JOIN_HISTORY_MAX_POINTS = 200
+
+# ==============================================================================
+# 15. 报名开放监视配置 (Registration Watcher)
+# ==============================================================================
+# python main.py watch：针对即将开始报名的缓存活动，在 joinStartTime 前后高频轮询单个活动详情
+# 建议配合 cron 每 10 分钟启动一次 (已有监视进程在运行时新进程直接退出；运行中的进程会定期重新扫描缓存)
+WATCH_HORIZON_MIN = 15           # 只监视未来 N 分钟内开始报名的活动
+WATCH_LEAD_SEC = 60              # 提前多少秒开始轮询
+WATCH_POLL_INTERVAL_SEC = 5      # 单个活动的轮询间隔 (秒)
+WATCH_MAX_RPS = 1.0              # 全局请求速率上限 (次/秒)，大量活动同时开放时各自的轮询间隔自动拉长
+WATCH_GIVE_UP_SEC = 600          # 报名开始时间过后仍未开放，超过该秒数后放弃
+WATCH_RESCAN_SEC = 60            # 运行中每隔 N 秒重新扫描缓存，纳入新进入监视范围的活动
+WATCH_STATE_FILE = "./pu_watch_state.json"   # 已提醒过的活动 (避免重复提醒；KV 后端时存于 KV)
+WATCH_LOCK_FILE = "./pu_watch.lock"          # 单实例锁 (KV 后端时改用集群共享的租约)
+
+# ==============================================================================
+# 16. 变更事件日志配置 (Change Events)
+# ==============================================================================
+# 处理器把每个活动的变化写成结构化事件，追加到 NDJSON 日志 (带单调递增序号)：
+# new 新活动 / delta 人数变化 / status 状态变化 / fields 其他字段变化 / notified 已通知 / suppressed 被限流
+# 下游 (PHP 接收端、看板) 只需从上次的字节偏移继续读取，无需对比整个缓存文件
+EVENT_LOG_ENABLED = True
+EVENT_LOG_FILE = "./pu_events.ndjson"
+
+# ==============================================================================
+# 17. 多节点协同配置 (Coordination)
+# ==============================================================================
+# "file": 本地文件后端 (单机，原有行为)
+# "kv":   共享 KV 后端，多台主机共用同一份缓存、订阅者状态与报名监视状态；每个分支 (以及报名监视)
+#         通过租约保证同一时刻只有一个节点在跑，运行期间定期续约；
+#         N 个节点的接口请求量与单节点相同，持有租约的节点宕机后租约到期由其他节点接管
+COORD_BACKEND = "file"
+# KV 服务地址 (python main.py kv-serve 可启动一个内存版 KV 服务用于测试或小规模部署)
+COORD_URL = "http://127.0.0.1:8765"
+# 节点标识，为空时使用 "主机名-进程号"
+COORD_NODE_ID = ""
+# 分支租约时长 (秒)，应大于单次运行耗时
+COORD_LEASE_TTL_SEC = 600
+# 共享详情缓存有效期 (秒)，期间其他节点可直接复用已请求过的活动详情
+COORD_DETAIL_TTL_SEC = 60
+
+# ==============================================================================
+# 18. 社团扫描配置 (Tribe Scanning)
+# ==============================================================================
+# 社团列表与社团活动都会自动翻页；每个社团在缓存中保存一个游标 (最新活动 ID + 首页指纹)，
+# 首页没有变化的社团只花一次请求即跳过，其活动沿用缓存记录
+TRIBE_PAGE_SIZE = 20                # 社团列表每页数量
+TRIBE_EVENT_PAGE_SIZE = 10          # 社团活动每页数量 (首页同时用于变化检测)
+TRIBE_MAX_PAGES = 10                # 单次翻页上限 (防止接口忽略 page 参数时死循环)
+TRIBE_MEMBERSHIP_REFRESH_MIN = 360  # "我加入的社团"列表刷新间隔 (分钟)，成员关系很少变化
+TRIBE_FULL_SCAN_MIN = 240           # 首页未变化的社团超过该间隔 (分钟) 仍完整重扫一次，兜底首页以外的变化
+
+# ==============================================================================
+# 19. 相似活动合并配置 (Near-Duplicate Collapsing)
+# ==============================================================================
+# 同一活动按班级/场次重复发布时，名称与介绍几乎相同。开启后对清洗后的 名称+介绍 计算 MinHash 签名，
+# 以 LSH 分桶保存在缓存中；同一相似簇本次产生的公共活动消息合并为一条，列出各个场次
+# (会改变公共活动的消息格式，默认关闭)
+DEDUP_ENABLED = False
+DEDUP_THRESHOLD = 0.8     # 签名相似度 (估计的 Jaccard 相似度) 达到该值视为相似
+DEDUP_NUM_PERM = 32       # MinHash 签名长度
+DEDUP_BANDS = 8           # LSH 分段数 (每段 DEDUP_NUM_PERM / DEDUP_BANDS 个值)
+DEDUP_SHINGLE = 3         # 文本切片长度 (字符)
+DEDUP_MAX_CHARS = 600     # 参与计算的最大字符数 (介绍很长时只取开头)
+
+# ==============================================================================
+# 20. JSON 编解码配置 (JSON Codec)
+# ==============================================================================
+# 接口响应解析与缓存读写使用的 JSON 库: "auto" 已安装 orjson 时使用 orjson，否则标准库; "stdlib" 强制标准库
+JSON_CODEC = "auto"
+# 缓存文件格式 (读取时自动识别，切换格式无需迁移):
+# "json"     带缩进的 JSON，便于人工查看 (原有格式)
+# "compact"  无缩进的紧凑 JSON，体积更小、写入更快
+# "snapshot" 二进制快照 (marshal)，读写最快，但不可直接查看，且只保证同一 Python 版本可读
+CACHE_FORMAT = "json"
+
 # 初始化全局 Session (复用 TCP 连接)
 _session = requests.Session()
 _session.headers.update(HEADERS)
@@ -111,6 +277,167 @@ def log(message):
     """简易日志输出"""
     current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{current_time}] {message}")
+def write_file_atomic(path: str, data: bytes):
+    """先写临时文件再原子替换：中途崩溃或磁盘写满时，原文件保持完整"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+# ------------------------------------------------------------------------------
+# JSON 编解码 (orjson 可选，输出统一为 UTF-8 bytes)
+# ------------------------------------------------------------------------------
+# 二进制快照文件头: 魔数 + marshal 数据；JSON 文件不可能以该魔数开头，读取时据此识别格式
+_SNAPSHOT_MAGIC = b"PUSNAP1\n"
+
+
+def _use_orjson() -> bool:
+    return orjson is not None and JSON_CODEC != "stdlib"
+def json_loads(data: Union[str, bytes]) -> Any:
+    """解析 JSON (str 或 UTF-8 bytes)"""
+    if _use_orjson():
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """
+    序列化为 UTF-8 bytes (不转义中文)
+    :param indent: True 时两空格缩进，否则紧凑输出 (无多余空格)
+    """
+    if _use_orjson():
+        try:
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            pass  # orjson 不支持的值 (如超过 64 位的整数)，退回标准库
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+def encode_cache(data: Dict[str, Any], cache_format: Optional[str] = None) -> bytes:
+    """按 CACHE_FORMAT 编码缓存"""
+    cache_format = cache_format or CACHE_FORMAT
+    if cache_format == "snapshot":
+        return _SNAPSHOT_MAGIC + marshal.dumps(data)
+    return json_dumps(data, indent=cache_format == "json")
+def decode_cache(raw: bytes) -> Dict[str, Any]:
+    """解码缓存，自动识别二进制快照与 JSON"""
+    if raw.startswith(_SNAPSHOT_MAGIC):
+        return marshal.loads(raw[len(_SNAPSHOT_MAGIC):])
+    return json_loads(raw)
+
+# ------------------------------------------------------------------------------
+# 阶段追踪 (关闭时 _trace_events 为 None，所有埋点只做一次判空)
+# ------------------------------------------------------------------------------
+_trace_events: Optional[List[Dict[str, Any]]] = None
+_trace_origin_ns = 0
+
+
+class _NullSpan:
+    """追踪关闭时使用的空 span (单例，无任何开销)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """一段计时区间，结束时记录为 Chrome trace-event 的 "X" (complete) 事件"""
+
+    def __init__(self, name: str, cat: str, args: Dict[str, Any]):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end_ns = time.perf_counter_ns()
+        if _trace_events is not None:
+            event = {
+                "name": self.name,
+                "cat": self.cat,
+                "ph": "X",
+                "ts": (self.start_ns - _trace_origin_ns) / 1000.0,
+                "dur": (end_ns - self.start_ns) / 1000.0,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            }
+            if self.args:
+                event["args"] = self.args
+            _trace_events.append(event)
+        return False
+
+
+def start_trace():
+    """开启阶段追踪 (清空已有事件)"""
+    global _trace_events, _trace_origin_ns
+    _trace_events = []
+    _trace_origin_ns = time.perf_counter_ns()
+def trace_span(name: str, cat: str = "stage", **args):
+    """
+    计时区间：with trace_span("save_data"): ...
+    追踪关闭时返回空 span 单例
+    """
+    if _trace_events is None:
+        return _NULL_SPAN
+    return _Span(name, cat, args)
+def _trace_iter(name: str, iterator: Iterable) -> Iterator:
+    """
+    [内部辅助] 为生成器阶段计时：每次 next() 记为一段 span。
+    流式流水线中上下游交替执行，嵌套的 span 即为各阶段的独占耗时。
+    """
+    it = iter(iterator)
+    while True:
+        with trace_span(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+def traced(name: str):
+    """
+    阶段追踪装饰器：普通函数记为一段 span，生成器函数按每次 next() 记录。
+    追踪关闭时只多一次判空。
+    """
+    def decorator(func):
+        is_gen = inspect.isgeneratorfunction(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace_events is None:
+                return func(*args, **kwargs)
+            if is_gen:
+                return _trace_iter(name, func(*args, **kwargs))
+            with _Span(name, "stage", {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+def dump_trace(path: str):
+    """将追踪事件写出为 Chrome/Perfetto trace-event JSON"""
+    if _trace_events is None:
+        return
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": _trace_events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        log(f"🧭 追踪数据已写入: {path} ({len(_trace_events)} 个事件)")
+    except Exception as e:
+        log(f"❌ 写入追踪数据失败: {e}")
 def safe_post_request(url: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
     带重试机制的通用 POST 请求函数
@@ -121,11 +448,12 @@ def safe_post_request(url: str, payload: Dict[str, Any]) -> Optional[Dict[str, A
     for attempt in range(1, MAX_RETRIES + 1):
         try:
             # 使用全局 session 发送请求
-            response = _session.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+            with trace_span(url.replace(_BASE_URL, ""), "http", attempt=attempt):
+                response = _session.post(url, json=payload, timeout=REQUEST_TIMEOUT)
 
             # 200 OK
             if response.status_code == 200:
-                return response.json()
+                return json_loads(response.content)
 
             # 401/403 鉴权失败 (通常不需要重试，直接返回)
             elif response.status_code in [401, 403]:
@@ -139,6 +467,9 @@ def safe_post_request(url: str, payload: Dict[str, Any]) -> Optional[Dict[str, A
         except requests.exceptions.RequestException as e:
             # 捕获网络层面的异常 (超时、DNS 错误等)
             log(f"⚠️ 网络错误: {e} - 重试 {attempt}/{MAX_RETRIES}")
+        except ValueError as e:
+            # 响应体不是合法 JSON (网关错误页等)，与网络错误一样重试
+            log(f"⚠️ 响应解析失败: {e} - 重试 {attempt}/{MAX_RETRIES}")
 
         # 指数退避策略：每次失败后随机等待 1~2 秒，避免请求过于频繁
         if attempt < MAX_RETRIES:
@@ -146,18 +477,22 @@ def safe_post_request(url: str, payload: Dict[str, Any]) -> Optional[Dict[str, A
 
     log(f"❌ 请求最终失败: {url}")
     return None
-def send_messages(messages: List[str]):
+@traced("send_messages")
+def send_messages(messages: List[str], push_url: Optional[str] = None):
     """
     发送消息逻辑：
-    1. Check: 如果 DIFF_LOG_URL 为空 -> 直接在控制台打印 (本地模式)
+    1. Check: 如果推送地址为空 -> 直接在控制台打印 (本地模式)
     2. Post:  如果配置了 URL -> Base64编码并 POST 发送 (远程模式)
+    :param push_url: 推送地址，默认使用 DIFF_LOG_URL (多用户订阅时传入订阅者自己的地址)
     """
     if not messages:
         return
 
+    target_url = DIFF_LOG_URL if push_url is None else push_url
+
     # ================= 分支 A: 本地打印模式 =================
     # 如果 URL 是空字符串、None 或未设置
-    if not DIFF_LOG_URL:
+    if not target_url:
         log(f"⚠️ 未配置推送地址 (DIFF_LOG_URL为空)，切换为控制台直接输出 ({len(messages)} 条):")
 
         for i, msg in enumerate(messages):
@@ -182,10 +517,11 @@ def send_messages(messages: List[str]):
     # 3. 构造并发送 POST 请求
     try:
         # 处理 URL: 去掉可能的查询参数 (如 ?msg=)，只保留脚本路径
-        target_url = DIFF_LOG_URL.split("?")[0] if "?" in DIFF_LOG_URL else DIFF_LOG_URL
+        target_url = target_url.split("?")[0] if "?" in target_url else target_url
 
         # 发送请求 (设置5秒超时)
-        response = requests.post(target_url, data={"msg": b64_data}, timeout=5)
+        with trace_span("push", "http", count=len(messages)):
+            response = requests.post(target_url, data={"msg": b64_data}, timeout=5)
 
         if response.status_code == 200:
             log("✅ 消息推送成功")
@@ -194,13 +530,13 @@ def send_messages(messages: List[str]):
 
     except requests.exceptions.RequestException as e:
         log(f"❌ 推送网络错误: {e}")
-def clean_activity_descriptions(data_list: List[Dict]) -> List[Dict]:
+def iter_clean_descriptions(data_iter: Iterable[Dict]) -> Iterator[Dict]:
     """
-    清洗功能函数：
-    遍历活动列表，去除 description 中的换行符(\n)、回车符(\r)、制表符(\t)等控制字符。
+    清洗功能函数 (流式)：
+    逐条去除 description 中的换行符(\n)、回车符(\r)、制表符(\t)等控制字符。
     将多行文本合并为单行，并去除首尾空白。
     """
-    for item in data_list:
+    for item in data_iter:
         desc = item.get("description")
 
         # 确保 description 存在且是字符串
@@ -214,67 +550,890 @@ def clean_activity_descriptions(data_list: List[Dict]) -> List[Dict]:
             # 更新回字典
             item["description"] = cleaned_desc
 
+        yield item
+def clean_activity_descriptions(data_list: List[Dict]) -> List[Dict]:
+    """列表版本的 iter_clean_descriptions (原地修改并返回原列表)"""
+    for _ in iter_clean_descriptions(data_list):
+        pass
     return data_list
-def filter_by_keywords(activity_list: List[Dict]) -> List[Dict]:
+def is_keyword_filtered(name: str) -> bool:
+    """标题是否包含 FILTER_KEYWORDS 中的任一屏蔽词"""
+    return bool(FILTER_KEYWORDS) and any(keyword in name for keyword in FILTER_KEYWORDS)
+def iter_filter_by_keywords(activity_iter: Iterable[Dict]) -> Iterator[Dict]:
     """
-    根据全局配置 FILTER_KEYWORDS 过滤活动标题
-    如果标题包含任一关键词，则直接剔除
+    根据全局配置 FILTER_KEYWORDS 过滤活动标题 (流式)
+    如果标题包含任一关键词，则直接剔除；输入耗尽后输出统计
     """
-    # 如果没有配置关键词，直接返回原列表，省去循环
-    if not FILTER_KEYWORDS:
-        return activity_list
-
-    valid_list = []
     dropped_count = 0
 
-    for item in activity_list:
+    for item in activity_iter:
         name = item.get("name", "")
 
         # 核心逻辑：检查 name 是否包含 FILTER_KEYWORDS 中的任意一个词
         # 只要命中一个，就视为包含
-        if any(keyword in name for keyword in FILTER_KEYWORDS):
+        if is_keyword_filtered(name):
             dropped_count += 1
             # log(f"   🚫 屏蔽关键词活动: {name}") # 调试时可开启
             continue
 
-        valid_list.append(item)
+        yield item
 
     if dropped_count > 0:
         log(f"   ✂️ [关键词过滤] 移除了 {dropped_count} 条标题包含屏蔽词的活动")
+def filter_by_keywords(activity_list: List[Dict]) -> List[Dict]:
+    """列表版本的 iter_filter_by_keywords"""
+    # 如果没有配置关键词，直接返回原列表，省去循环
+    if not FILTER_KEYWORDS:
+        return activity_list
+    return list(iter_filter_by_keywords(activity_list))
+
+# ------------------------------------------------------------------------------
+# 协同后端 (缓存读写 / 分支租约 / 共享详情缓存)
+# ------------------------------------------------------------------------------
+# KV 后端中缓存按分组拆成多个键，节点只写回自己持有租约的分组，避免互相覆盖
+_CACHE_SECTIONS = {
+    "tribe": ["tribe", "tribe_last_run", "tribe_cursors", "tribe_membership"],
+    "public": ["public", "public_last_run", "dedup"],
+    "meta": ["last_run_time", "digest"],
+}
+
+
+class FileBackend:
+    """
+    本地文件后端：缓存存于 DATA_FILE，辅助状态存于各自的文件，不共享详情 (原有单机行为)
+    分支租约总能取得 (单机由 cron 顺序执行)；报名监视锁以锁文件实现，保证单机只有一个监视进程。
+    """
+
+    def __init__(self):
+        self._held_locks: Set[str] = set()
+        self._lock_token = str(os.getpid())
+
+    @staticmethod
+    def _state_path(name: str) -> str:
+        return {"watch": WATCH_STATE_FILE, "subscriptions": SUBSCRIPTION_STATE_FILE}[name]
+
+    @staticmethod
+    def _lock_path(name: str) -> Optional[str]:
+        return {"watch": WATCH_LOCK_FILE}.get(name)
+
+    def load_cache(self) -> Dict[str, Any]:
+        if not os.path.exists(DATA_FILE):
+            return {
+                "last_run_time": "未运行",
+                "tribe": {},
+                "public": {}
+            }
+        try:
+            with open(DATA_FILE, 'rb') as f:
+                return decode_cache(f.read())
+        except Exception as e:
+            print(f"⚠️ 数据文件损坏，重置数据: {e}")
+            return {"last_run_time": "未运行", "tribe": {}, "public": {}}
+
+    def save_cache(self, data: Dict[str, Any], sections: Optional[List[str]] = None):
+        # 单机时整份写回，sections 无意义；原子替换，写到一半崩溃或磁盘写满时旧缓存保持完整
+        write_file_atomic(DATA_FILE, encode_cache(data))
+
+    def load_state(self, name: str) -> Dict[str, Any]:
+        path = self._state_path(name)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'rb') as f:
+                return json_loads(f.read())
+        except Exception as e:
+            print(f"⚠️ 状态文件 {path} 损坏，重置数据: {e}")
+            return {}
+
+    def save_state(self, name: str, value: Dict[str, Any]):
+        write_file_atomic(self._state_path(name), json_dumps(value))
+
+    def acquire_lease(self, name: str, ttl: Optional[float] = None) -> bool:
+        path = self._lock_path(name)
+        if path is None:
+            return True
+        if name in self._held_locks:
+            # 续约：锁文件仍是本进程的才刷新修改时间 (可能已被其他进程当作失效锁接管)
+            try:
+                with open(path, 'r') as f:
+                    if f.read() != self._lock_token:
+                        self._held_locks.discard(name)
+                        return False
+                os.utime(path)
+                return True
+            except OSError:
+                self._held_locks.discard(name)
+                return False
+        stale_sec = ttl or COORD_LEASE_TTL_SEC
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, self._lock_token.encode())
+                os.close(fd)
+                self._held_locks.add(name)
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) < stale_sec:
+                        return False
+                    os.remove(path)
+                except OSError:
+                    return False
+        return False
+
+    def release_lease(self, name: str):
+        if name in self._held_locks:
+            self._held_locks.discard(name)
+            with contextlib.suppress(OSError):
+                os.remove(self._lock_path(name))
+
+    def get_detail(self, act_id: Any) -> Optional[Dict[str, Any]]:
+        return None
+
+    def put_detail(self, act_id: Any, info: Dict[str, Any]):
+        pass
+
+
+class KVBackend:
+    """
+    共享 KV 后端：通过 HTTP 访问 KV 服务 (协议见 _KVRequestHandler)
+    - 缓存: cache:tribe / cache:public / cache:meta 三个键
+    - 辅助状态: state:watch (报名监视已提醒记录) / state:subscriptions (订阅者状态)
+    - 租约: lease:<name>，到期前只有持有者可以续约 (分支租约与报名监视锁 lease:watch)
+    - 详情: detail:<id>，带过期时间
+    接口异常时直接抛出，由调用方决定跳过本次运行，绝不把"读不到"当成"空缓存"。
+    """
+
+    def __init__(self, url: str, node_id: str):
+        self.url = url.rstrip("/") + "/kv"
+        self.node_id = node_id
+        # 独立 Session：不能把 PU 的 Authorization 头发给 KV 服务
+        self.session = requests.Session()
+
+    def _call(self, op: str, **payload) -> Dict[str, Any]:
+        payload["op"] = op
+        response = self.session.post(self.url, json=payload, timeout=10)
+        response.raise_for_status()
+        return json_loads(response.content)
+
+    def load_cache(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"last_run_time": "未运行", "tribe": {}, "public": {}}
+        for section in _CACHE_SECTIONS:
+            value = self._call("get", key=f"cache:{section}").get("value")
+            if value:
+                data.update(value)
+        return data
+
+    def save_cache(self, data: Dict[str, Any], sections: Optional[List[str]] = None):
+        for section in sections or list(_CACHE_SECTIONS):
+            value = {k: data[k] for k in _CACHE_SECTIONS[section] if k in data}
+            self._call("put", key=f"cache:{section}", value=value)
+
+    def load_state(self, name: str) -> Dict[str, Any]:
+        return self._call("get", key=f"state:{name}").get("value") or {}
+
+    def save_state(self, name: str, value: Dict[str, Any]):
+        self._call("put", key=f"state:{name}", value=value)
+
+    def acquire_lease(self, name: str, ttl: Optional[float] = None) -> bool:
+        result = self._call("lease", key=f"lease:{name}", owner=self.node_id, ttl=ttl or COORD_LEASE_TTL_SEC)
+        if not result.get("ok"):
+            log(f"🔒 租约 {name} 由节点 {result.get('owner')} 持有")
+        return bool(result.get("ok"))
+
+    def release_lease(self, name: str):
+        try:
+            self._call("release", key=f"lease:{name}", owner=self.node_id)
+        except Exception as e:
+            # 释放失败只会让其他节点多等到租约过期
+            log(f"⚠️ 释放租约 {name} 失败: {e}")
+
+    def get_detail(self, act_id: Any) -> Optional[Dict[str, Any]]:
+        try:
+            return self._call("get", key=f"detail:{act_id}").get("value")
+        except Exception:
+            return None
+
+    def put_detail(self, act_id: Any, info: Dict[str, Any]):
+        try:
+            self._call("put", key=f"detail:{act_id}", value=info, ttl=COORD_DETAIL_TTL_SEC)
+        except Exception:
+            pass
+
 
-    return valid_list
+_backend = None
 
+
+def get_backend():
+    """按 COORD_BACKEND 创建 (并复用) 协同后端"""
+    global _backend
+    if _backend is None:
+        if COORD_BACKEND == "kv":
+            node_id = COORD_NODE_ID or f"{socket.gethostname()}-{os.getpid()}"
+            _backend = KVBackend(COORD_URL, node_id)
+            log(f"🌐 使用共享 KV 后端 {COORD_URL} (节点 {node_id})")
+        else:
+            _backend = FileBackend()
+    return _backend
+def acquire_branch_leases(backend) -> Dict[str, bool]:
+    """
+    尝试取得两个分支的租约
+    摘要模式下两个分支共用同一个摘要缓冲区，因此共用一个租约 (由同一节点一起执行)。
+    :return: {"tribe": 是否持有, "public": 是否持有}
+    """
+    if DIGEST_ENABLED:
+        owned = backend.acquire_lease("monitor")
+        return {"tribe": owned, "public": owned}
+    return {"tribe": backend.acquire_lease("tribe"), "public": backend.acquire_lease("public")}
+def _branch_lease_names(owned: Dict[str, bool]) -> List[str]:
+    """[内部辅助] 本节点持有的租约名 (摘要模式下为共用的 "monitor")"""
+    if DIGEST_ENABLED:
+        return ["monitor"] if owned.get("tribe") else []
+    return [name for name, held in owned.items() if held]
+def release_branch_leases(backend, owned: Dict[str, bool]):
+    for name in _branch_lease_names(owned):
+        backend.release_lease(name)
+class LeaseLostError(RuntimeError):
+    """租约续约失败 (已被其他节点接管，或协同后端不可用)，本次运行必须放弃保存与推送"""
+def renew_branch_leases(backend, owned: Dict[str, bool]):
+    """续约本节点持有的分支租约，任何一个失败即抛出 LeaseLostError"""
+    for name in _branch_lease_names(owned):
+        try:
+            renewed = backend.acquire_lease(name)
+        except Exception as e:
+            raise LeaseLostError(f"租约 {name} 续约失败: {e}")
+        if not renewed:
+            raise LeaseLostError(f"租约 {name} 已被其他节点接管")
+
+
+class _KVRequestHandler(BaseHTTPRequestHandler):
+    """
+    内存 KV 服务 (kv-serve 子命令)，POST /kv，请求体 JSON:
+      {"op": "get", "key"}                        -> {"value"}
+      {"op": "put", "key", "value", "ttl"?}       -> {"ok": true}
+      {"op": "lease", "key", "owner", "ttl"}      -> {"ok", "owner"}  空闲/过期/本人续约时成功
+      {"op": "release", "key", "owner"}           -> {"ok"}
+    """
+    store: Dict[str, Tuple[Any, float]] = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        try:
+            body = json_loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            result = self._handle(body)
+            status = 200
+        except Exception as e:
+            result = {"error": str(e)}
+            status = 400
+        payload = json_dumps(result)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        op, key = body["op"], body["key"]
+        now = time.time()
+        with self.lock:
+            value, expires = self.store.get(key, (None, 0))
+            alive = not expires or expires > now
+            if op == "get":
+                return {"value": value if alive else None}
+            if op == "put":
+                ttl = body.get("ttl")
+                self.store[key] = (body["value"], now + ttl if ttl else 0)
+                return {"ok": True}
+            if op == "lease":
+                if alive and value and value != body["owner"]:
+                    return {"ok": False, "owner": value}
+                self.store[key] = (body["owner"], now + body["ttl"])
+                return {"ok": True, "owner": body["owner"]}
+            if op == "release":
+                if value == body["owner"]:
+                    self.store.pop(key, None)
+                return {"ok": True}
+        raise ValueError(f"unknown op: {op}")
+
+    def log_message(self, format, *args):
+        pass
+def run_kv_server(args: argparse.Namespace):
+    """kv-serve 子命令：启动内存 KV 服务 (重启后数据清空，生产环境可换成同协议的持久化服务)"""
+    server = ThreadingHTTPServer((args.host, args.port), _KVRequestHandler)
+    log(f"🌐 KV 服务已启动: http://{args.host}:{args.port}/kv")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+@traced("load_data")
 def load_data() -> Dict[str, Any]:
     """
-    读取数据文件
+    读取数据 (本地文件或共享 KV，见 COORD_BACKEND)
     结构: {
         "last_run_time": "yyyy-mm-dd HH:MM:SS",
         "tribe": { activity_id: { ...完整数据..., "_state": {...} } },
         "public": { activity_id: { ...完整数据..., "_state": {...} } }
     }
     """
-    if not os.path.exists(DATA_FILE):
-        return {
-            "last_run_time": "未运行",
-            "tribe": {},
-            "public": {}
-        }
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"⚠️ 数据文件损坏，重置数据: {e}")
-        return {"last_run_time": "未运行", "tribe": {}, "public": {}}
-def save_data(data: Dict[str, Any]):
-    """保存完整数据到硬盘"""
+    return get_backend().load_cache()
+@traced("save_data")
+def save_data(data: Dict[str, Any], sections: Optional[List[str]] = None) -> bool:
+    """
+    保存数据
+    :param sections: 只写回指定分组 ("tribe" / "public" / "meta")，None 为全部；本地文件后端总是整份写回
+    :return: 是否保存成功 (失败只记录日志)
+    """
     # 更新最后运行时间
     data["last_run_time"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        get_backend().save_cache(data, sections)
+        return True
     except Exception as e:
         print(f"❌ 保存数据失败: {e}")
+        return False
+
+# ------------------------------------------------------------------------------
+# 本地活动索引 (SQLite + FTS5)
+# ------------------------------------------------------------------------------
+_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id          TEXT PRIMARY KEY,
+    source      TEXT,
+    name        TEXT,
+    description TEXT,
+    creator     TEXT,
+    tags        TEXT,
+    status      INTEGER,
+    status_name TEXT,
+    credit      REAL,
+    pu_amount   REAL,
+    join_start  INTEGER,
+    join_end    INTEGER,
+    start_time  INTEGER,
+    end_time    INTEGER,
+    join_count  INTEGER,
+    allow_count INTEGER,
+    first_seen  TEXT,
+    last_seen   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_activities_join_start ON activities(join_start);
+CREATE INDEX IF NOT EXISTS idx_activities_start_time ON activities(start_time);
+CREATE INDEX IF NOT EXISTS idx_activities_credit ON activities(credit);
+CREATE TRIGGER IF NOT EXISTS activities_ai AFTER INSERT ON activities BEGIN
+    INSERT INTO activities_fts(rowid, name, description, creator, tags)
+    VALUES (new.rowid, new.name, new.description, new.creator, new.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS activities_ad AFTER DELETE ON activities BEGIN
+    INSERT INTO activities_fts(activities_fts, rowid, name, description, creator, tags)
+    VALUES ('delete', old.rowid, old.name, old.description, old.creator, old.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS activities_au AFTER UPDATE ON activities BEGIN
+    INSERT INTO activities_fts(activities_fts, rowid, name, description, creator, tags)
+    VALUES ('delete', old.rowid, old.name, old.description, old.creator, old.tags);
+    INSERT INTO activities_fts(rowid, name, description, creator, tags)
+    VALUES (new.rowid, new.name, new.description, new.creator, new.tags);
+END;
+"""
+
+# trigram 分词支持中文子串检索 (SQLite >= 3.34)，查询词至少 3 个字；
+# 2 个字的词 (如 "讲座") 走二元切分表 activities_bigram (rowid 与 activities 一致，由 store_activity 维护)；
+# 单字退化为 LIKE
+_FTS_MIN_TERM = 3
+_BIGRAM_TERM = 2
+
+
+def _bigrams(*texts: str) -> str:
+    """[内部辅助] 将文本切成相邻两字的词元 (空格分隔)，不跨越空白，供 unicode61 分词"""
+    grams = []
+    for text in texts:
+        for chunk in (text or "").lower().split():
+            grams.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+    return " ".join(grams)
+def _index_bigrams(conn: sqlite3.Connection, act_id: str):
+    """[内部辅助] 按 activities 中的当前内容重建一条活动的二元切分词元"""
+    row = conn.execute("SELECT rowid, name, description, creator, tags FROM activities WHERE id = ?", (act_id,)).fetchone()
+    if row is None:
+        return
+    conn.execute("DELETE FROM activities_bigram WHERE rowid = ?", (row[0],))
+    conn.execute("INSERT INTO activities_bigram(rowid, grams) VALUES (?, ?)", (row[0], _bigrams(*row[1:])))
+def open_activity_store(path: str = None) -> Optional[sqlite3.Connection]:
+    """打开 (必要时创建) 本地活动索引，失败返回 None"""
+    try:
+        conn = sqlite3.connect(path or ACTIVITY_STORE_FILE)
+        conn.row_factory = sqlite3.Row
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS activities_fts USING fts5("
+            "name, description, creator, tags, content='activities', content_rowid='rowid', tokenize='trigram')"
+        )
+        conn.executescript(_STORE_SCHEMA)
+        has_bigram = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'activities_bigram'").fetchone()
+        if not has_bigram:
+            # 旧版本创建的索引：建表后为已有活动补齐二元切分
+            conn.execute("CREATE VIRTUAL TABLE activities_bigram USING fts5(grams)")
+            for (act_id,) in conn.execute("SELECT id FROM activities").fetchall():
+                _index_bigrams(conn, act_id)
+            conn.commit()
+        return conn
+    except sqlite3.Error as e:
+        log(f"⚠️ 本地活动索引不可用 (需要 SQLite FTS5 trigram 支持): {e}")
+        return None
+def close_activity_store(conn: sqlite3.Connection, commit: bool = True):
+    """提交并关闭本地活动索引；索引只是旁路数据，出错只记录日志"""
+    try:
+        if commit:
+            conn.commit()
+    except sqlite3.Error as e:
+        log(f"⚠️ 本地活动索引提交失败: {e}")
+    finally:
+        with contextlib.suppress(sqlite3.Error):
+            conn.close()
+def _to_number(value: Any) -> Optional[float]:
+    """[内部辅助] 学分/银豆等字段转数值，无法解析返回 None"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+def store_activity(conn: sqlite3.Connection, act: Dict[str, Any], source: str):
+    """
+    写入/更新一条活动 (以活动 ID 去重，保留首次发现时间)
+    :param source: "tribe" / "public"
+    """
+    tags = act.get("tags") or []
+    if isinstance(tags, list):
+        tag_names = [t.get("name", "") for t in tags if isinstance(t, dict)]
+    else:
+        tag_names = [str(tags)]
+    if act.get("tag"):
+        tag_names.append(str(act.get("tag")))
+
+    now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute(
+        """
+        INSERT INTO activities (id, source, name, description, creator, tags, status, status_name,
+                                credit, pu_amount, join_start, join_end, start_time, end_time,
+                                join_count, allow_count, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            source = excluded.source, name = excluded.name, description = excluded.description,
+            creator = excluded.creator, tags = excluded.tags, status = excluded.status,
+            status_name = excluded.status_name, credit = excluded.credit, pu_amount = excluded.pu_amount,
+            join_start = excluded.join_start, join_end = excluded.join_end,
+            start_time = excluded.start_time, end_time = excluded.end_time,
+            join_count = excluded.join_count, allow_count = excluded.allow_count,
+            last_seen = excluded.last_seen
+        """,
+        (
+            str(act.get("id")), source, act.get("name") or "", act.get("description") or "",
+            act.get("creatorName") or "", " ".join(x for x in tag_names if x),
+            act.get("status"), act.get("statusName") or "",
+            _to_number(act.get("credit")), _to_number(act.get("puAmount")),
+            int(_to_timestamp(act.get("joinStartTime"))) or None, int(_to_timestamp(act.get("joinEndTime"))) or None,
+            int(_to_timestamp(act.get("startTime"))) or None, int(_to_timestamp(act.get("endTime"))) or None,
+            _to_number(act.get("joinUserCount")), _to_number(act.get("allowUserCount")),
+            now_str, now_str,
+        ),
+    )
+    _index_bigrams(conn, str(act.get("id")))
+def query_activity_store(conn: sqlite3.Connection, text: str = "", time_from: Optional[float] = None,
+                         time_to: Optional[float] = None, time_field: str = "join_start",
+                         min_credit: Optional[float] = None, max_credit: Optional[float] = None,
+                         min_pu: Optional[float] = None, max_pu: Optional[float] = None,
+                         status: Optional[str] = None, source: Optional[str] = None,
+                         limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    离线查询本地活动索引 (不发送任何网络请求)
+    :param text: 空格分隔的关键词，全部命中 (name / description / creator / tags)
+    :param time_field: 时间范围作用的字段 "join_start" (报名开始) 或 "start_time" (活动开始)
+    """
+    if time_field not in ("join_start", "start_time"):
+        raise ValueError(f"不支持的时间字段: {time_field}")
+
+    sql = "SELECT a.* FROM activities a"
+    where = []
+    params: List[Any] = []
+
+    terms = [t for t in (text or "").split() if t]
+    fts_terms = [t for t in terms if len(t) >= _FTS_MIN_TERM]
+    bigram_terms = [t.lower() for t in terms if len(t) == _BIGRAM_TERM]
+    like_terms = [t for t in terms if len(t) < _BIGRAM_TERM]
+
+    if fts_terms:
+        sql += " JOIN activities_fts f ON f.rowid = a.rowid"
+        where.append("activities_fts MATCH ?")
+        params.append(" ".join('"' + t.replace('"', '""') + '"' for t in fts_terms))
+    if bigram_terms:
+        sql += " JOIN activities_bigram b ON b.rowid = a.rowid"
+        where.append("activities_bigram MATCH ?")
+        params.append(" ".join('"' + t.replace('"', '""') + '"' for t in bigram_terms))
+    for term in like_terms:
+        where.append("(a.name LIKE ? OR a.description LIKE ? OR a.creator LIKE ? OR a.tags LIKE ?)")
+        params.extend([f"%{term}%"] * 4)
+
+    for column, op, value in (
+        (time_field, ">=", time_from), (time_field, "<", time_to),
+        ("credit", ">=", min_credit), ("credit", "<=", max_credit),
+        ("pu_amount", ">=", min_pu), ("pu_amount", "<=", max_pu),
+    ):
+        if value is not None:
+            where.append(f"a.{column} {op} ?")
+            params.append(value)
+    if status:
+        where.append("a.status_name = ?")
+        params.append(status)
+    if source:
+        where.append("a.source = ?")
+        params.append(source)
+
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY a.{time_field} DESC LIMIT ?"
+    params.append(limit)
+
+    return [dict(row) for row in conn.execute(sql, params)]
+def _parse_query_time(value: Optional[str]) -> Optional[float]:
+    """[内部辅助] 解析命令行时间参数 'YYYY-MM-DD' 或 'YYYY-MM-DD HH:MM'"""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"无法解析时间: {value} (格式 YYYY-MM-DD 或 YYYY-MM-DD HH:MM)")
+def run_query(args: argparse.Namespace):
+    """query 子命令：按条件检索本地活动索引并打印结果"""
+    conn = open_activity_store()
+    if conn is None:
+        return
+
+    start = time.perf_counter()
+    rows = query_activity_store(
+        conn, text=" ".join(args.text), time_from=_parse_query_time(args.time_from),
+        time_to=_parse_query_time(args.time_to), time_field=args.by,
+        min_credit=args.min_credit, max_credit=args.max_credit,
+        min_pu=args.min_pu, max_pu=args.max_pu,
+        status=args.status, source=args.source, limit=args.limit,
+    )
+    cost_ms = (time.perf_counter() - start) * 1000
+    conn.close()
 
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+
+    for row in rows:
+        print(
+            f"[{_format_date_mmddhm(row['join_start'])}] {row['name']} | "
+            f"学分 {row['credit'] if row['credit'] is not None else '-'} / 银豆 {row['pu_amount'] if row['pu_amount'] is not None else '-'} | "
+            f"{row['status_name'] or '-'} | {'社团' if row['source'] == 'tribe' else '公共'} | "
+            f"已报名 {row['join_count'] if row['join_count'] is not None else '-'}/{row['allow_count'] if row['allow_count'] is not None else '-'} | ID {row['id']}"
+        )
+    log(f"🔎 共 {len(rows)} 条结果 ({cost_ms:.1f} ms)")
+
+# ------------------------------------------------------------------------------
+# 归档 (结束/消失的活动 -> gzip NDJSON 分段，只追加)
+# ------------------------------------------------------------------------------
+# 归档结构:
+#   ARCHIVE_DIR/segment-000001.ndjson.gz  每次写入追加一个 gzip member (多 member 拼接仍是合法 gzip)
+#   ARCHIVE_DIR/index.json               {"segments": [{"file", "bytes", "records",
+#                                          "members": [{"offset", "count", "from", "to"}]}]}
+# 通过 member 的字节偏移可以直接定位并解压某一批记录，无需从头读整个分段。
+_ENDED_STATUS = ["已结束", "已完结", "完结待审核", "完结被驳回"]
+
+
+def _archive_index_path() -> str:
+    return os.path.join(ARCHIVE_DIR, "index.json")
+def load_archive_index() -> Dict[str, Any]:
+    """读取归档偏移索引，不存在时返回空索引"""
+    path = _archive_index_path()
+    if not os.path.exists(path):
+        return {"segments": []}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        log(f"⚠️ 归档索引损坏: {e}")
+        return {"segments": []}
+def _save_archive_index(index: Dict[str, Any]):
+    """[内部辅助] 先写临时文件再替换，避免中途失败留下半个索引"""
+    path = _archive_index_path()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+def collect_archive_records(old_group: Dict[str, Any], new_group: Dict[str, Any], group_name: str) -> List[Dict[str, Any]]:
+    """
+    找出本次从分组中消失的活动，构造归档记录
+    :param group_name: "tribe" / "public"
+    """
+    # 本次一条都没取到，多半是网络或鉴权失败，不视为活动消失
+    if not new_group:
+        return []
+
+    archived_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    records = []
+    for act_id, record in old_group.items():
+        if act_id in new_group:
+            continue
+        ended = record.get("statusName") in _ENDED_STATUS or 0 < _to_timestamp(record.get("endTime")) < time.time()
+        records.append({
+            "id": act_id,
+            "group": group_name,
+            "reason": "ended" if ended else "dropped",
+            "archived_at": archived_at,
+            "record": record,
+        })
+    return records
+@traced("archive_records")
+def archive_records(records: List[Dict[str, Any]]):
+    """将归档记录作为一个新的 gzip member 追加到当前分段，并更新偏移索引"""
+    if not records:
+        return
+    try:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        index = load_archive_index()
+        segments = index.setdefault("segments", [])
+
+        # 当前分段超过体积上限 -> 轮转到新分段
+        if not segments or segments[-1]["bytes"] >= ARCHIVE_SEGMENT_MAX_BYTES:
+            segments.append({"file": f"segment-{len(segments) + 1:06d}.ndjson.gz", "bytes": 0, "records": 0, "members": []})
+        segment = segments[-1]
+        path = os.path.join(ARCHIVE_DIR, segment["file"])
+
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode('utf-8')
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(payload))
+
+        segment["bytes"] = os.path.getsize(path)
+        segment["records"] += len(records)
+        segment["members"].append({
+            "offset": offset,
+            "count": len(records),
+            "from": min(r["archived_at"] for r in records),
+            "to": max(r["archived_at"] for r in records),
+        })
+        _save_archive_index(index)
+        log(f"🗄️ 已归档 {len(records)} 个活动 -> {segment['file']}")
+    except Exception as e:
+        log(f"❌ 归档失败: {e}")
+def iter_archive(since: Optional[str] = None, until: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    流式读取归档记录 (按 member 逐批解压，内存占用与单批大小有关)
+    :param since / until: 归档时间范围 "YYYY-MM-DD HH:MM:SS"，借助索引跳过范围外的 member
+    """
+    for segment in load_archive_index().get("segments", []):
+        path = os.path.join(ARCHIVE_DIR, segment["file"])
+        if not os.path.exists(path):
+            continue
+        members = segment.get("members", [])
+        with open(path, 'rb') as f:
+            for i, member in enumerate(members):
+                if since and member["to"] < since:
+                    continue
+                if until and member["from"] >= until:
+                    continue
+                end = members[i + 1]["offset"] if i + 1 < len(members) else segment["bytes"]
+                f.seek(member["offset"])
+                chunk = gzip.decompress(f.read(end - member["offset"]))
+                for line in chunk.decode('utf-8').splitlines():
+                    if line:
+                        record = json.loads(line)
+                        if since and record["archived_at"] < since:
+                            continue
+                        if until and record["archived_at"] >= until:
+                            continue
+                        yield record
+def run_archive_dump(args: argparse.Namespace):
+    """archive 子命令：以 NDJSON 流式输出归档记录，便于管道给分析脚本"""
+    since = args.since
+    until = args.until
+    count = 0
+    for record in iter_archive(since, until):
+        if args.id and record.get("id") != args.id:
+            continue
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    log(f"🗄️ 共输出 {count} 条归档记录")
+
+
+# ------------------------------------------------------------------------------
+# 变更事件日志 (只追加的 NDJSON，序号单调递增)
+# ------------------------------------------------------------------------------
+# 每行一个事件: {"seq", "ts", "type", "group", "id", ...附加字段}
+# 下游记住上次读到的字节偏移即可增量消费 (events 子命令的 --offset)，代价只与新增事件数有关。
+class ChangeEventLog:
+    """
+    变更事件写入器
+    运行期间事件只暂存在内存，主流程保存状态成功后 commit() 才编号并写入日志；
+    运行失败时暂存的事件随 close() 丢弃，下游不会看到缓存从未记录过的变化。
+    序号从日志最后一行续接，跨进程运行保持单调递增。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._repair_tail()
+        self.seq = self._read_last_seq()
+        self.count = 0
+        self.pending: List[Dict[str, Any]] = []
+
+    def _repair_tail(self):
+        """[内部辅助] 截掉末尾被中断写入的半行 (没有换行结尾)，保证新事件从新的一行开始"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            pos = size
+            while pos > 0:
+                start = max(0, pos - 65536)
+                f.seek(start)
+                newline = f.read(pos - start).rfind(b"\n")
+                if newline >= 0:
+                    break
+                pos = start
+            keep = start + newline + 1 if pos > 0 else 0
+            f.truncate(keep)
+        log(f"⚠️ 事件日志末尾有 {size - keep} 字节未写完的半行，已截掉")
+
+    def _read_last_seq(self) -> int:
+        """[内部辅助] 只读文件末尾一小段取最后一行的序号，避免扫描整个日志"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 65536))
+            lines = f.read().splitlines()
+        for line in reversed(lines):
+            try:
+                return int(json.loads(line)["seq"])
+            except Exception:
+                # 无法解析的行 (旧版本留下的损坏行)，继续往前找
+                continue
+        return 0
+
+    def emit(self, event_type: str, group: str, act_id: Any, **fields):
+        event = {
+            "ts": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "type": event_type,
+            "group": group,
+            "id": str(act_id),
+        }
+        event.update(fields)
+        self.pending.append(event)
+
+    def commit(self):
+        """为暂存的事件编号并一次性追加写入 (写入后 fsync)"""
+        if not self.pending:
+            return
+        lines = []
+        for event in self.pending:
+            self.seq += 1
+            lines.append(json.dumps(dict(seq=self.seq, **event), ensure_ascii=False) + "\n")
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        self.count += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        if self.pending:
+            log(f"⚠️ 状态未保存，丢弃 {len(self.pending)} 条未提交的变更事件")
+            self.pending = []
+        if self.count:
+            log(f"🧾 已写入 {self.count} 条变更事件 (seq ≤ {self.seq})")
+
+
+# 当前运行的事件日志，None 表示未开启 (基准测试/模拟器调用处理器时不会写日志)
+_event_log: Optional[ChangeEventLog] = None
+
+
+def open_event_log() -> Optional[ChangeEventLog]:
+    """开启变更事件日志，失败时仅记录日志，不影响主流程"""
+    global _event_log
+    if not EVENT_LOG_ENABLED:
+        return None
+    try:
+        _event_log = ChangeEventLog(EVENT_LOG_FILE)
+    except Exception as e:
+        log(f"⚠️ 事件日志打开失败: {e}")
+        _event_log = None
+    return _event_log
+def commit_event_log():
+    """状态保存成功后提交本次暂存的事件，写入失败只记录日志"""
+    if _event_log is not None:
+        try:
+            _event_log.commit()
+        except Exception as e:
+            log(f"⚠️ 事件日志写入失败: {e}")
+def close_event_log():
+    """结束本次运行的事件日志 (未提交的事件被丢弃)；主流程在 finally 中调用"""
+    global _event_log
+    if _event_log is not None:
+        _event_log.close()
+        _event_log = None
+def emit_change_event(event_type: str, group: str, act_id: Any, **fields):
+    """暂存一条变更事件 (事件日志未开启时无操作)"""
+    if _event_log is not None:
+        _event_log.emit(event_type, group, act_id, **fields)
+def _emit_activity_events(group: str, act: Dict[str, Any], is_new: bool, last_joined: int, current_joined: int, changed_fields: Set[str]):
+    """[内部辅助] 处理器共用：根据人数与字段变化写入 new / delta / status / fields 事件"""
+    if _event_log is None:
+        return
+    act_id = act.get("id")
+    if is_new:
+        emit_change_event("new", group, act_id, name=act.get("name"), joined=current_joined,
+                          status=act.get("statusName"))
+        return
+    if current_joined != last_joined:
+        emit_change_event("delta", group, act_id, joined=current_joined, delta=current_joined - last_joined)
+    if "statusName" in changed_fields:
+        emit_change_event("status", group, act_id, status=act.get("statusName"))
+    others = sorted(changed_fields - {"statusName"})
+    if others:
+        emit_change_event("fields", group, act_id, fields=others)
+def iter_change_events(offset: int = 0, after_seq: int = 0) -> Iterator[Tuple[Dict[str, Any], int]]:
+    """
+    从指定字节偏移开始读取事件
+    :return: (事件, 该事件之后的字节偏移)，消费方保存最后的偏移，下次从这里继续
+    """
+    if not os.path.exists(EVENT_LOG_FILE):
+        return
+    with open(EVENT_LOG_FILE, 'rb') as f:
+        f.seek(offset)
+        while True:
+            line = f.readline()
+            # 没有换行结尾的是正在写入的半行，留到下次再读
+            if not line or not line.endswith(b"\n"):
+                return
+            line_offset, offset = offset, offset + len(line)
+            try:
+                event = json.loads(line)
+                seq = int(event["seq"])
+            except (ValueError, KeyError, TypeError) as e:
+                # 损坏的行 (旧版本在半行后继续追加造成) 跳过并报告，不阻塞后续事件
+                sys.stderr.write(f"⚠️ 跳过无法解析的事件行 (偏移 {line_offset}): {e}\n")
+                continue
+            if seq > after_seq:
+                yield event, offset
+def run_events_dump(args: argparse.Namespace):
+    """events 子命令：输出 offset 之后的事件 (NDJSON)，最后把下次应使用的偏移写到 stderr"""
+    # 标准输出只留事件本身，偏移写到 stderr，方便脚本直接管道消费
+    next_offset = args.offset
+    for event, next_offset in iter_change_events(args.offset, args.after):
+        sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+    sys.stderr.write(f"next_offset={next_offset}\n")
+
+@traced("fetch_global_activity_list")
 def fetch_global_activity_list(limit: int = 25) -> List[Dict[str, Any]]:
     """
     获取全局活动列表（初始大池子）
@@ -303,6 +1462,7 @@ def fetch_global_activity_list(limit: int = 25) -> List[Dict[str, Any]]:
     else:
         log("⚠️ 全局列表获取失败或数据为空")
         return []
+@traced("fetch_ended_activity_list")
 def fetch_ended_activity_list(limit: int = 25) -> List[Dict[str, Any]]:
     """
     获取已结束的活动列表 (Status=3)
@@ -323,20 +1483,22 @@ def fetch_ended_activity_list(limit: int = 25) -> List[Dict[str, Any]]:
     if data and "data" in data and "list" in data["data"]:
         return data["data"]["list"]
     return []
-def filter_effective_activities(all_activities: List[Dict[str, Any]],ended_activities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def iter_effective_activities(all_activities: Iterable[Dict[str, Any]],ended_activities: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
     """
-    集合减法：从全部活动中剔除已结束的活动
+    集合减法 (流式)：从全部活动中剔除已结束的活动
     :param all_activities: 全局活动列表 (大池子)
     :param ended_activities: 已结束活动列表 (黑名单)
-    :return: 剩余的有效活动列表
+    :return: 逐条产出剩余的有效活动
     """
     # 1. 提取黑名单 ID 集合 (使用 set 查找速度更快)
     ended_ids = {item["id"] for item in ended_activities if "id" in item}
 
-    effective_list = []
+    total = 0
+    effective = 0
 
     # 2. 遍历大池子进行筛选
     for item in all_activities:
+        total += 1
         act_id = item.get("id")
         name = item.get("name", "")
 
@@ -354,35 +1516,106 @@ def filter_effective_activities(all_activities: List[Dict[str, Any]],ended_activ
         if not act_id:
             continue
 
-        effective_list.append(item)
+        effective += 1
+        yield item
 
-    log(f"📉 数据清洗: 原始 {len(all_activities)} 条 - 已结束 {len(ended_ids)} 条 = 有效 {len(effective_list)} 条")
-    return effective_list
-def fetch_my_tribes(limit: int = 5) -> List[Dict[str, Any]]:
+    log(f"📉 数据清洗: 原始 {total} 条 - 已结束 {len(ended_ids)} 条 = 有效 {effective} 条")
+def filter_effective_activities(all_activities: List[Dict[str, Any]],ended_activities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """列表版本的 iter_effective_activities"""
+    return list(iter_effective_activities(all_activities, ended_activities))
+def _fetch_pages(url: str, payload: Dict[str, Any], page_size: int, first_page: Optional[List[Dict]] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    [内部辅助] 逐页请求列表接口，不满一页或达到 TRIBE_MAX_PAGES 时停止
+    :param first_page: 已经请求过的第一页 (避免重复请求)，从第二页继续
     """
-    获取我加入的社团/组织列表
-    :param limit: 获取社团的数量上限
+    page = 1
+    previous_first_id = None
+    while page <= TRIBE_MAX_PAGES:
+        if first_page is not None and page == 1:
+            items = first_page
+        else:
+            data = safe_post_request(url, dict(payload, page=page, limit=page_size))
+            if not (data and isinstance(data.get("data"), dict) and "list" in data["data"]):
+                return
+            items = data["data"]["list"] or []
+        if not items:
+            return
+        # 接口忽略 page 参数时每页内容相同，直接停止
+        if items[0].get("id") == previous_first_id:
+            return
+        previous_first_id = items[0].get("id")
+        yield items
+        if len(items) < page_size:
+            return
+        page += 1
+@traced("fetch_my_tribes")
+def fetch_my_tribes(page_size: int = TRIBE_PAGE_SIZE) -> List[Dict[str, Any]]:
+    """
+    获取我加入的社团/组织列表 (自动翻页)
+    :param page_size: 每页数量
     """
     payload = {
-        "page": 1,
-        "limit": limit,
         "type": 2  # type=2 通常指“我加入的”
     }
 
     log(f"📡 正在获取我的社团列表...")
-    data = safe_post_request(URL_MY_TRIBE, payload)
-
-    if data and "data" in data and "list" in data["data"]:
-        tribes = data["data"]["list"]
+    tribes = [t for items in _fetch_pages(URL_MY_TRIBE, payload, page_size) for t in items]
+    if tribes:
         log(f"✅ 获取到 {len(tribes)} 个社团/组织")
+    return tribes
+def load_my_tribes(cache_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    读取"我加入的社团"列表：缓存未超过 TRIBE_MEMBERSHIP_REFRESH_MIN 时直接使用，否则重新请求
+    结果写回 cache_data["tribe_membership"] = {"tribes": [...], "refreshed": "..."}
+    """
+    membership = cache_data.get("tribe_membership") or {}
+    try:
+        refreshed = datetime.datetime.strptime(membership.get("refreshed", ""), "%Y-%m-%d %H:%M:%S")
+        fresh = (datetime.datetime.now() - refreshed).total_seconds() / 60 < TRIBE_MEMBERSHIP_REFRESH_MIN
+    except ValueError:
+        fresh = False
+    if fresh and membership.get("tribes"):
+        log(f"📋 使用缓存的社团列表 ({len(membership['tribes'])} 个，刷新于 {membership['refreshed']})")
+        return membership["tribes"]
+
+    tribes = fetch_my_tribes()
+    if tribes:
+        cache_data["tribe_membership"] = {
+            "tribes": [{"id": t.get("id"), "name": t.get("name")} for t in tribes],
+            "refreshed": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
         return tribes
-    return []
-def fetch_valid_tribe_activities(tribe_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # 请求失败时退回旧列表，不因一次网络错误丢掉全部社团
+    return membership.get("tribes") or []
+def _tribe_page_fingerprint(events: List[Dict[str, Any]]) -> int:
+    """[内部辅助] 社团活动首页指纹：活动 ID / 状态 / 报名人数任一变化都会改变指纹"""
+    key = "|".join(f"{e.get('id')}:{e.get('statusName')}:{e.get('joinUserCount')}" for e in events)
+    return zlib.crc32(key.encode('utf-8'))
+def _tribe_scan_due(cursor: Dict[str, Any], now: datetime.datetime) -> bool:
+    """[内部辅助] 距上次完整扫描超过 TRIBE_FULL_SCAN_MIN"""
+    try:
+        scanned = datetime.datetime.strptime(cursor.get("scanned", ""), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return True
+    return (now - scanned).total_seconds() / 60 >= TRIBE_FULL_SCAN_MIN
+@traced("fetch_valid_tribe_activities")
+def iter_valid_tribe_activities(tribe_list: Iterable[Dict[str, Any]], cursors: Optional[Dict[str, Any]] = None,
+                                carried_ids: Optional[List[str]] = None,
+                                staged_cursors: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
     """
-    遍历社团列表，获取每个社团的有效活动
-    逻辑：请求活动 -> 剔除 '已结束'/'已完结' -> 汇总
+    遍历社团列表，获取每个社团的有效活动 (流式，自动翻页)
+    逻辑：请求活动 -> 剔除 '已结束'/'已完结' -> 逐条产出
+    每个社团的活动在该社团请求返回后立即向下游传递，无需等待全部社团扫描完成。
+
+    :param cursors: 社团游标 {社团ID: {"newest_id", "fingerprint", "event_ids", "scanned"}}，只读；
+                    为 None 时不做增量判断，完整扫描每个社团
+    :param carried_ids: 输出参数，首页未变化而被跳过的社团的有效活动 ID (调用方沿用缓存记录)
+    :param staged_cursors: 输出参数，本次完整扫描的社团的新游标；调用方在这些活动全部处理成功后
+                           才用 _commit_tribe_cursors 写回，详情请求失败的活动不会因首页未变化而被长期跳过
     """
-    valid_tribe_events = []
+    found = 0
+    skipped_tribes = 0
+    now = datetime.datetime.now()
 
     # 定义无效状态集合
     INVALID_STATUS = ["已结束", "已完结","完结待审核","完结被驳回"]
@@ -391,21 +1624,31 @@ def fetch_valid_tribe_activities(tribe_list: List[Dict[str, Any]]) -> List[Dict[
         tid = tribe.get("id")
         tname = tribe.get("name", "未知社团")
 
-        # 构造请求获取该社团的活动
-        payload = {
-            "tribeID": tid,
-            "page": 1,
-            "limit": 4  # 每个社团只看最近的5个活动
-        }
+        # 先只请求首页 (一次请求)，用于变化检测
+        payload = {"tribeID": tid}
+        data = safe_post_request(URL_TRIBE_EVENT, dict(payload, page=1, limit=TRIBE_EVENT_PAGE_SIZE))
+        if not (data and isinstance(data.get("data"), dict) and "list" in data["data"]):
+            # 请求失败时沿用上次结果，避免社团活动被当成消失
+            if cursors is not None and carried_ids is not None and str(tid) in cursors:
+                carried_ids.extend(cursors[str(tid)].get("event_ids", []))
+            continue
+        first_page = data["data"]["list"] or []
+
+        fingerprint = _tribe_page_fingerprint(first_page)
+        newest_id = str(first_page[0].get("id")) if first_page else None
+        cursor = cursors.get(str(tid)) if cursors is not None else None
+        if (cursor and carried_ids is not None and cursor.get("fingerprint") == fingerprint
+                and cursor.get("newest_id") == newest_id and not _tribe_scan_due(cursor, now)):
+            # 首页未变化 -> 跳过翻页与详情请求
+            carried_ids.extend(cursor.get("event_ids", []))
+            skipped_tribes += 1
+            continue
 
         # log(f"🔍 正在检查社团: {tname} ...")
         # (注释掉以免日志太多，只在发现有效活动时输出)
-
-        data = safe_post_request(URL_TRIBE_EVENT, payload)
-
-        if data and "data" in data and "list" in data["data"]:
-            events = data["data"]["list"]
-
+        event_ids = []
+        for events in _fetch_pages(URL_TRIBE_EVENT, payload, TRIBE_EVENT_PAGE_SIZE, first_page=first_page):
+            page_valid = 0
             for event in events:
                 status = event.get("statusName", "")
 
@@ -415,31 +1658,121 @@ def fetch_valid_tribe_activities(tribe_list: List[Dict[str, Any]]) -> List[Dict[
                     event["_source_type"] = "社团"
                     event["_source_name"] = tname
 
-                    valid_tribe_events.append(event)
+                    found += 1
+                    page_valid += 1
+                    event_ids.append(str(event.get("id")))
                     log(f"   🌟 发现社团有效活动: [{tname}] {event.get('name')}")
-
-    log(f"✅ 社团活动扫描完成，共发现 {len(valid_tribe_events)} 个有效活动")
-    return valid_tribe_events
+                    yield event
+            # 活动按时间倒序，一整页都已结束时更早的页也不必再翻
+            if not page_valid:
+                break
+
+        if staged_cursors is not None:
+            staged_cursors[str(tid)] = {
+                "newest_id": newest_id,
+                "fingerprint": fingerprint,
+                "event_ids": event_ids,
+                "scanned": now.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+
+    if skipped_tribes:
+        log(f"⏭️ {skipped_tribes} 个社团首页未变化，已跳过 (沿用缓存 {len(carried_ids)} 个活动)")
+    log(f"✅ 社团活动扫描完成，共发现 {found} 个有效活动")
+def _commit_tribe_cursors(cursors: Dict[str, Any], staged: Dict[str, Any], failed_ids: Set[str],
+                          tribe_list: List[Dict[str, Any]]):
+    """
+    [内部辅助] 推进社团游标：只有该社团产出的活动没有详情请求失败时才写回新游标；
+    否则删除旧游标，下次运行完整重扫该社团。已不在"我的社团"中的社团游标一并清除。
+    """
+    member_ids = {str(t.get("id")) for t in tribe_list}
+    for tid in [tid for tid in cursors if tid not in member_ids]:
+        del cursors[tid]
+    held = 0
+    for tid, cursor in staged.items():
+        if failed_ids.isdisjoint(cursor["event_ids"]):
+            cursors[tid] = cursor
+        else:
+            cursors.pop(tid, None)
+            held += 1
+    if held:
+        log(f"↩️ {held} 个社团有活动详情请求失败，游标不推进，下次重新扫描")
+def fetch_valid_tribe_activities(tribe_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """列表版本的 iter_valid_tribe_activities"""
+    return list(iter_valid_tribe_activities(tribe_list))
 def get_non_tribe_valid_activities(global_valid: List[Dict],tribe_valid: List[Dict]) -> List[Dict]:
     """
     逻辑分离：获取 [全局有效] 中除去 [社团有效] 之外的活动
     即：公共/其他类型的有效活动
     """
-    # 1. 获取社团活动的 ID 集合
-    tribe_ids = {item["id"] for item in tribe_valid if "id" in item}
+    # 1. 获取社团活动的 ID 集合 (统一转为字符串，缓存中的 ID 是字符串键)
+    tribe_ids = {str(item["id"]) for item in tribe_valid if "id" in item}
 
     other_activities = []
 
     # 2. 遍历全局有效活动，如果不在社团ID集合中，则归为“其他”
     for item in global_valid:
-        if item["id"] not in tribe_ids:
+        if str(item["id"]) not in tribe_ids:
             other_activities.append(item)
 
     log(f"✂️ 分离完成: 社团活动 {len(tribe_ids)} 个，其他公共活动 {len(other_activities)} 个")
     return other_activities
-def fetch_and_clean_data(activity_list: List[Dict], filter_tribe_limit: bool = True) -> List[Dict]:
+def fetch_activity_detail(act_id: Any) -> Optional[Dict[str, Any]]:
     """
-    核心清洗函数 (最终完整版)：
+    请求 '/activity/info' 并解析出详情字典
+    兼容部分接口直接返回 dict 或嵌套在 baseInfo 中；失败或为空时返回 None
+    """
+    resp = safe_post_request(URL_ACTIVITY_INFO, {"id": act_id})
+
+    # 空值防御：确保 resp 和 data 都不为空
+    if not resp or not resp.get("data"):
+        return None
+
+    raw_data = resp["data"]
+    full_info = raw_data.get("baseInfo", raw_data)
+
+    # 若 baseInfo 解析失败，返回 None
+    return full_info or None
+def _extract_required_fields(full_info: Dict[str, Any], act_id: Any) -> Dict[str, Any]:
+    """[内部辅助] 按 REQUIRED_FIELDS 白名单提取字段，并强制回填 ID"""
+    clean_item = {}
+
+    # 提取白名单字段
+    for field in REQUIRED_FIELDS:
+        clean_item[field] = full_info.get(field, None)
+
+    # 【关键】强制覆盖 ID，防止详情接口返回 null
+    clean_item["id"] = act_id
+    return clean_item
+def _extract_restriction_ids(full_info: Dict[str, Any]) -> Tuple[List[Any], List[Any]]:
+    """[内部辅助] 从详情中提取 (限定学院 ID 列表, 限定年级 ID 列表)，无限制时为空列表"""
+    allowed_college_ids = []
+    allow_college = full_info.get("allowCollege")
+    if allow_college and isinstance(allow_college, list):
+        allowed_college_ids = [c.get('id') for c in allow_college if isinstance(c, dict) and c.get('id')]
+
+    allowed_year_ids = []
+    allow_years_info = full_info.get("allowYears")
+    if allow_years_info and isinstance(allow_years_info, list):
+        allowed_year_ids = [y.get('id') for y in allow_years_info if isinstance(y, dict) and y.get('id')]
+
+    return allowed_college_ids, allowed_year_ids
+def check_profile_restrictions(allowed_college_ids: List[Any], allowed_year_ids: List[Any], allow_years: List[Any], college_id: Any) -> Optional[str]:
+    """
+    判断某个用户画像 (年级 + 学院) 能否参加活动
+    :return: None 表示通过；"college" / "year" 表示被对应限制剔除
+    """
+    # 如果有学院限制，且我的学院ID不在允许列表中 -> 丢弃
+    if allowed_college_ids and college_id not in allowed_college_ids:
+        return "college"
+    # 集合求交集：如果 (我的年级) 与 (允许年级) 无交集 -> 丢弃
+    if allowed_year_ids and not (set(allow_years) & set(allowed_year_ids)):
+        return "year"
+    return None
+@traced("fetch_and_clean_data")
+def iter_fetch_and_clean_data(activity_iter: Iterable[Dict], filter_tribe_limit: bool = True, filter_profile: bool = True,
+                              failed_ids: Optional[Set[str]] = None) -> Iterator[Dict]:
+    """
+    核心清洗函数 (流式版)：
     1. 请求 '/activity/info' 获取详情。
     2. 安全解析 baseInfo，防御空数据。
     3. 【过滤】根据 filter_tribe_limit 决定是否过滤有社团限制的活动。
@@ -447,40 +1780,45 @@ def fetch_and_clean_data(activity_list: List[Dict], filter_tribe_limit: bool = T
     5. 【过滤】过滤非本年级 (allowYears) 的活动。
     6. 【修复】强制回填 ID，防止详情接口缺少 ID 字段。
 
-    :param activity_list: 待处理的活动列表
+    每个活动的详情返回并通过过滤后立即产出，下游无需等待全部详情请求完成。
+
+    :param activity_iter: 待处理的活动 (列表或上游生成器)
     :param filter_tribe_limit:
            - True (默认): 用于公共列表清洗。发现有社团限制则丢弃（视为别人的社团）。
            - False: 用于"我的社团"列表清洗。保留社团限制（视为我自己的社团）。
+    :param filter_profile:
+           - True (默认): 按 ALLOW_YEARS / TARGET_COLLEGE_ID 过滤学院与年级。
+           - False: 不过滤，改为在结果中保留 _allowCollegeIds / _allowYearIds，供多用户订阅匹配。
+    :param failed_ids: 输出参数，详情请求失败的活动 ID (字符串)
     """
-    cleaned_data_list = []
-    total = len(activity_list)
+    cleaned_count = 0
+    total = len(activity_iter) if hasattr(activity_iter, "__len__") else "?"
+    total_str = f" {total} 个活动" if total != "?" else "活动 (流式输入)"
+    processed = 0
 
     # 统计计数器
     skipped_tribe = 0  # 因社团限制被踢
     skipped_college = 0  # 因学院限制被踢
     skipped_year = 0  # 因年级限制被踢
 
-    log(f"🧹 开始清洗 {total} 个活动 (社团限制过滤: {'开启' if filter_tribe_limit else '关闭'})...")
+    log(f"🧹 开始清洗{total_str} (社团限制过滤: {'开启' if filter_tribe_limit else '关闭'})...")
+    backend = get_backend()
 
-    for index, item in enumerate(activity_list):
+    for index, item in enumerate(activity_iter):
+        processed = index + 1
         # 优先使用列表中的 ID，这是最可靠的
         act_id = item.get("id")
         if not act_id: continue
 
-        # 1. 请求详情
-        resp = safe_post_request(URL_ACTIVITY_INFO, {"id": act_id})
-
-        # 2. 空值防御：确保 resp 和 data 都不为空
-        if not resp or not resp.get("data"):
-            continue
-
-        # 兼容部分接口直接返回 dict 或嵌套在 baseInfo 中
-        raw_data = resp["data"]
-        full_info = raw_data.get("baseInfo", raw_data)
-
-        # 若 baseInfo 解析失败，跳过
+        # 1. 请求详情 (含空值防御与 baseInfo 解析)；多节点时先查共享详情缓存
+        full_info = backend.get_detail(act_id)
         if not full_info:
-            continue
+            full_info = fetch_activity_detail(act_id)
+            if not full_info:
+                if failed_ids is not None:
+                    failed_ids.add(str(act_id))
+                continue
+            backend.put_detail(act_id, full_info)
 
         # =================== 过滤逻辑 A: 社团 (受 filter_tribe_limit 控制) ===================
         if filter_tribe_limit:
@@ -490,33 +1828,24 @@ def fetch_and_clean_data(activity_list: List[Dict], filter_tribe_limit: bool = T
                 skipped_tribe += 1
                 continue
 
-                # =================== 过滤逻辑 B: 学院 ===================
-        allow_college = full_info.get("allowCollege")
-        if allow_college and isinstance(allow_college, list) and len(allow_college) > 0:
-            allowed_college_ids = [c.get('id') for c in allow_college if c.get('id')]
-            # 如果有限制，且我的学院ID不在允许列表中 -> 丢弃
-            if TARGET_COLLEGE_ID not in allowed_college_ids:
+        # =================== 过滤逻辑 B/C: 学院 & 年级 ===================
+        allowed_college_ids, allowed_year_ids = _extract_restriction_ids(full_info)
+        if filter_profile:
+            reason = check_profile_restrictions(allowed_college_ids, allowed_year_ids, ALLOW_YEARS, TARGET_COLLEGE_ID)
+            if reason == "college":
                 skipped_college += 1
                 continue
-
-        # =================== 过滤逻辑 C: 年级 ===================
-        allow_years_info = full_info.get("allowYears")
-        if allow_years_info and isinstance(allow_years_info, list) and len(allow_years_info) > 0:
-            allowed_year_ids = [y.get('id') for y in allow_years_info if y.get('id')]
-            # 集合求交集：如果 (我的年级) 与 (允许年级) 无交集 -> 丢弃
-            if not (set(ALLOW_YEARS) & set(allowed_year_ids)):
+            if reason == "year":
                 skipped_year += 1
                 continue
 
         # =================== 数据提取与 ID 修复 ===================
-        clean_item = {}
+        clean_item = _extract_required_fields(full_info, act_id)
 
-        # 提取白名单字段
-        for field in REQUIRED_FIELDS:
-            clean_item[field] = full_info.get(field, None)
-
-        # 【关键】强制覆盖 ID，防止详情接口返回 null
-        clean_item["id"] = act_id
+        # 不在此处过滤画像时，保留限制信息给订阅匹配使用
+        if not filter_profile:
+            clean_item["_allowCollegeIds"] = allowed_college_ids
+            clean_item["_allowYearIds"] = allowed_year_ids
 
         # 补充来源标记 (如果原始列表中有)
         if "_source_type" in item:
@@ -524,73 +1853,205 @@ def fetch_and_clean_data(activity_list: List[Dict], filter_tribe_limit: bool = T
         if "_source_name" in item:
             clean_item["_source_name"] = item["_source_name"]
 
-        cleaned_data_list.append(clean_item)
+        cleaned_count += 1
+        yield clean_item
 
         # 进度日志
         if (index + 1) % 5 == 0:
-            log(f"   ...已处理 {index + 1}/{total} (当前有效: {len(cleaned_data_list)})")
+            log(f"   ...已处理 {index + 1}/{total} (当前有效: {cleaned_count})")
 
-    log(f"✨ 清洗报告: 输入{total} -> 社团剔除{skipped_tribe} -> 学院剔除{skipped_college} -> 年级剔除{skipped_year} -> 输出{len(cleaned_data_list)}")
-    return cleaned_data_list
+    log(f"✨ 清洗报告: 输入{processed} -> 社团剔除{skipped_tribe} -> 学院剔除{skipped_college} -> 年级剔除{skipped_year} -> 输出{cleaned_count}")
+def fetch_and_clean_data(activity_list: List[Dict], filter_tribe_limit: bool = True, filter_profile: bool = True) -> List[Dict]:
+    """列表版本的 iter_fetch_and_clean_data"""
+    return list(iter_fetch_and_clean_data(activity_list, filter_tribe_limit, filter_profile))
 
-def fetch_target_activities_by_mode(enable_tribe: bool = False,enable_public: bool = False) -> Tuple[List[Dict], List[Dict]]:
+def _iter_carried_tribe_records(carried_ids: List[str], cached_tribe: Dict[str, Any], yielded: Set[str]) -> Iterator[Dict]:
     """
-    按需调度中心：根据开关获取社团或公共活动
-    优点：不执行的任务完全不发送网络请求，降低封号风险。
-
-    :param enable_tribe: 是否执行社团活动获取
-    :param enable_public: 是否执行公共活动获取
-    :return: (final_tribe_data, final_public_data)
+    [内部辅助] 跳过的社团的活动：直接产出缓存中的记录 (处理器会发现人数与字段均未变化，不产生消息)
+    屏蔽词在记录写入缓存后才加入时，同样不再产出
     """
-    final_tribe_data = []
-    final_public_data = []
-
-    # ================= 任务分支 A: 社团活动 =================
-    if enable_tribe:
-        log("🚀 [任务启动] 开始获取“我的社团”活动...")
-
-        # 1. 获取我的社团
-        my_tribes = fetch_my_tribes(limit=10)
+    for act_id in carried_ids:
+        if act_id in yielded or act_id not in cached_tribe:
+            continue
+        if is_keyword_filtered(cached_tribe[act_id].get("name", "")):
+            continue
+        yielded.add(act_id)
+        yield dict(cached_tribe[act_id])
+def _as_public_record(item: Dict) -> Dict:
+    """[内部辅助] 社团活动记录的公共副本：去掉社团来源标记，与公共分支单独运行时的记录一致"""
+    return {k: v for k, v in item.items() if k not in ("_source_type", "_source_name")}
+def stream_tribe_activities(cache_data: Optional[Dict[str, Any]] = None) -> Iterator[Dict]:
+    """
+    社团分支流水线 (惰性)：社团列表 -> 社团活动 -> 关键词过滤 -> 详情清洗 -> 描述清洗
+    每个活动在其详情返回后立即流向下游处理，流水线本身不保留中间列表；
+    处理结果 (新缓存与消息) 仍随活动数增长，运行结束保存后统一写回与推送。
+    生成器被消费时才会发出请求。
+    :param cache_data: 完整缓存；传入时使用其中的社团列表与游标做增量扫描，否则完整扫描。
+                       游标在全部活动的详情处理完后才推进 (见 _commit_tribe_cursors)
+    """
+    log("🚀 [任务启动] 开始获取“我的社团”活动...")
+
+    # 1. 获取我的社团 (成员关系按较慢的周期刷新)
+    my_tribes = load_my_tribes(cache_data) if cache_data is not None else fetch_my_tribes()
+
+    # 2. 获取社团内部列表 (首页未变化的社团被跳过，其活动 ID 记入 carried)
+    cursors = cache_data.setdefault("tribe_cursors", {}) if cache_data is not None else None
+    carried: List[str] = []
+    staged: Dict[str, Any] = {}
+    failed: Set[str] = set()
+    events = iter_valid_tribe_activities(my_tribes, cursors, carried, staged)
+
+    # 3. 关键词过滤 (在请求详情前执行，节省流量)
+    events = iter_filter_by_keywords(events)
+
+    # 4. 深度清洗 (filter_tribe_limit=False, 保留社团限制)
+    details = iter_fetch_and_clean_data(events, filter_tribe_limit=False, failed_ids=failed)
+
+    # 5. 去除描述中的换行符
+    yielded: Set[str] = set()
+    for item in iter_clean_descriptions(details):
+        yielded.add(str(item.get("id")))
+        yield item
+    if cursors is not None:
+        _commit_tribe_cursors(cursors, staged, failed, my_tribes)
+
+    # 6. 跳过的社团沿用缓存记录
+    if cache_data is not None:
+        yield from _iter_carried_tribe_records(carried, cache_data.get("tribe", {}), yielded)
+def stream_public_activities(filter_profile: bool = True) -> Iterator[Dict]:
+    """
+    公共分支流水线 (惰性)：全局列表 - 已结束列表 -> 关键词过滤 -> 详情清洗 -> 描述清洗
+    :param filter_profile: 传给 iter_fetch_and_clean_data，多用户订阅模式下为 False
+    """
+    log("🚀 [任务启动] 开始获取“公共”活动...")
 
-        # 2. 获取社团内部列表
-        raw_tribe_activities = fetch_valid_tribe_activities(my_tribes)
+    # 1. 获取全局列表
+    raw_global_list = fetch_global_activity_list(limit=30)
+    if not raw_global_list:
+        log("全局暂无有效活动")
+        return
 
-        # 3. 关键词过滤 (在请求详情前执行，节省流量)
-        raw_tribe_activities = filter_by_keywords(raw_tribe_activities)
+    # 2. 获取已结束列表 (用于去重)
+    raw_ended_list = fetch_ended_activity_list(limit=30)
 
-        # 4. 深度清洗 (filter_tribe_limit=False, 保留社团限制)
-        if raw_tribe_activities:
-            final_tribe_data = fetch_and_clean_data(raw_tribe_activities, filter_tribe_limit=False)
-            # 去除描述中的换行符
-            final_tribe_data = clean_activity_descriptions(final_tribe_data)
-        else:
-            log("社团暂无有效活动")
+    # 3. 初步清洗 (剔除已结束)
+    effective_global = iter_effective_activities(raw_global_list, raw_ended_list)
 
-    # ================= 任务分支 B: 公共活动 =================
-    if enable_public:
-        log("🚀 [任务启动] 开始获取“公共”活动...")
+    # 4. 关键词过滤
+    effective_global = iter_filter_by_keywords(effective_global)
 
-        # 1. 获取全局列表
-        raw_global_list = fetch_global_activity_list(limit=30)
+    # 5. 深度清洗 (filter_tribe_limit=True, 剔除有社团限制的活动)
+    # 注意：这里不需要再做"集合减法"，因为 fetch_and_clean_data 内部会检查 allowTribe。
+    # 如果一个活动在全局列表里，但它是社团专属，filter_tribe_limit=True 会把它过滤掉。
+    details = iter_fetch_and_clean_data(effective_global, filter_tribe_limit=True, filter_profile=filter_profile)
 
-        # 2. 获取已结束列表 (用于去重)
+    # 6. 去除描述中的换行符
+    yield from iter_clean_descriptions(details)
+def stream_unified_activities(filter_profile: bool = True, cache_data: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    合并流水线 (社团与公共同时到期时使用)：
+    1. 先扫描社团活动，再取全局列表，并用 get_non_tribe_valid_activities 剔除其中的社团活动，
+       避免公共分支为它们重复请求详情。
+    2. 两个分支合并为一个按活动 ID 去重的工作队列，每个 ID 只请求一次详情。
+    3. 产出 ("tribe" / "public", 清洗后的活动)，由调用方路由给对应处理器。
+    4. 同时出现在全局列表中、且没有社团限制 (allowTribe 为空) 的社团活动，单独运行公共分支时也会
+       进入公共缓存：用同一份详情 (跳过的社团则用缓存记录) 再产出一次 "public"，
+       否则它会在合并运行时从公共缓存消失，下一次单独的公共运行又被当成新活动重复通知。
+    :param filter_profile: 公共活动是否按本人画像过滤 (多用户订阅模式下为 False)
+    :param cache_data: 完整缓存，用于社团增量扫描 (同 stream_tribe_activities)
+    """
+    log("🚀 [任务启动] 合并获取“我的社团”与“公共”活动...")
+
+    # 1. 社团分支：社团列表 -> 社团活动 -> 关键词过滤
+    my_tribes = load_my_tribes(cache_data) if cache_data is not None else fetch_my_tribes()
+    cursors = cache_data.setdefault("tribe_cursors", {}) if cache_data is not None else None
+    carried: List[str] = []
+    staged: Dict[str, Any] = {}
+    failed: Set[str] = set()
+    tribe_events = list(iter_filter_by_keywords(iter_valid_tribe_activities(my_tribes, cursors, carried, staged)))
+
+    # 2. 公共分支：全局列表 - 已结束 -> 关键词过滤 -> 剔除社团活动
+    public_events = []
+    public_listed: Set[str] = set()
+    cross_dup = 0
+    raw_global_list = fetch_global_activity_list(limit=30)
+    if raw_global_list:
         raw_ended_list = fetch_ended_activity_list(limit=30)
+        effective_global = list(iter_filter_by_keywords(iter_effective_activities(raw_global_list, raw_ended_list)))
+        public_listed = {str(e["id"]) for e in effective_global if "id" in e}
+        # 跳过的社团的活动同样不进入公共队列 (缓存中没有记录、无法沿用的除外)
+        cached_tribe = cache_data.get("tribe", {}) if cache_data is not None else {}
+        public_events = get_non_tribe_valid_activities(effective_global, tribe_events + [{"id": i} for i in carried if i in cached_tribe])
+        cross_dup = len(effective_global) - len(public_events)
+    else:
+        log("全局暂无有效活动")
+
+    # 3. 按活动 ID 去重 (同一活动可能出现在多个社团中)
+    seen_ids = set()
+    queue_dup = 0
+
+    def _dedupe(events: List[Dict]) -> List[Dict]:
+        nonlocal queue_dup
+        unique = []
+        for event in events:
+            act_id = event.get("id")
+            if act_id in seen_ids:
+                queue_dup += 1
+                continue
+            seen_ids.add(act_id)
+            unique.append(event)
+        return unique
+
+    tribe_queue = _dedupe(tribe_events)
+    public_queue = _dedupe(public_events)
+    log(f"🔗 合并队列: 社团 {len(tribe_queue)} 个 + 公共 {len(public_queue)} 个，避免重复详情请求 {cross_dup + queue_dup} 次")
+
+    # 4. 详情清洗后按来源路由 (跳过的社团沿用缓存记录)
+    #    社团队列先不按画像过滤，保留限制信息：同一份详情可能还要按公共分支的规则再判定一次
+    yielded: Set[str] = set()
+    tribe_details = iter_fetch_and_clean_data(tribe_queue, filter_tribe_limit=False, filter_profile=False, failed_ids=failed)
+    for item in iter_clean_descriptions(tribe_details):
+        act_id = str(item.get("id"))
+        college_ids = item.pop("_allowCollegeIds", [])
+        year_ids = item.pop("_allowYearIds", [])
+        passes_profile = check_profile_restrictions(college_ids, year_ids, ALLOW_YEARS, TARGET_COLLEGE_ID) is None
+
+        public_twin = None
+        if act_id in public_listed and not item.get("allowTribe") and (passes_profile or not filter_profile):
+            public_twin = _as_public_record(item)
+            if not filter_profile:
+                public_twin["_allowCollegeIds"] = college_ids
+                public_twin["_allowYearIds"] = year_ids
+
+        if passes_profile:
+            yielded.add(act_id)
+            yield "tribe", item
+        if public_twin is not None:
+            yield "public", public_twin
+    if cursors is not None:
+        _commit_tribe_cursors(cursors, staged, failed, my_tribes)
+    if cache_data is not None:
+        cached_public = cache_data.get("public", {})
+        for item in _iter_carried_tribe_records(carried, cache_data.get("tribe", {}), yielded):
+            yield "tribe", item
+            act_id = str(item.get("id"))
+            if act_id in public_listed and not item.get("allowTribe"):
+                yield "public", dict(cached_public[act_id]) if act_id in cached_public else _as_public_record(item)
+    for item in iter_clean_descriptions(iter_fetch_and_clean_data(public_queue, filter_tribe_limit=True, filter_profile=filter_profile)):
+        yield "public", item
+def fetch_target_activities_by_mode(enable_tribe: bool = False,enable_public: bool = False) -> Tuple[List[Dict], List[Dict]]:
+    """
+    按需调度中心：根据开关获取社团或公共活动 (一次性取回完整列表)
+    优点：不执行的任务完全不发送网络请求，降低封号风险。
+    主流程使用 stream_tribe_activities / stream_public_activities 逐条处理，
+    本函数保留给需要完整列表的场景。
 
-        # 3. 初步清洗 (剔除已结束)
-        effective_global = filter_effective_activities(raw_global_list, raw_ended_list)
-
-         # 4. 关键词过滤
-        effective_global = filter_by_keywords(effective_global)
-
-        # 5. 深度清洗 (filter_tribe_limit=True, 剔除有社团限制的活动)
-        # 注意：这里不需要再做"集合减法"，因为 fetch_and_clean_data 内部会检查 allowTribe。
-        # 如果一个活动在全局列表里，但它是社团专属，filter_tribe_limit=True 会把它过滤掉。
-        if effective_global:
-            final_public_data = fetch_and_clean_data(effective_global, filter_tribe_limit=True)
-            # 去除描述中的换行符
-            final_public_data = clean_activity_descriptions(final_public_data)
-        else:
-            log("全局暂无有效活动")
+    :param enable_tribe: 是否执行社团活动获取
+    :param enable_public: 是否执行公共活动获取
+    :return: (final_tribe_data, final_public_data)
+    """
+    final_tribe_data = list(stream_tribe_activities()) if enable_tribe else []
+    final_public_data = list(stream_public_activities()) if enable_public else []
 
     # 汇总报告
     total_tribe = len(final_tribe_data)
@@ -626,31 +2087,32 @@ def _format_date_mmddhm(ts: Any) -> str:
         return ts_str
     except:
         return str(ts)
+def _to_timestamp(t: Any) -> float:
+    """[内部辅助] 时间字符串/秒级或毫秒级时间戳 -> 秒级时间戳，无法解析返回 0"""
+    if not t: return 0
+    try:
+        if isinstance(t, str) and "-" in t and ":" in t:
+            return datetime.datetime.strptime(str(t), "%Y-%m-%d %H:%M:%S").timestamp()
+        val = float(t)
+        return val / 1000.0 if val > 10000000000 else val
+    except:
+        return 0
 def _get_days_diff(start_str: Any, end_str: Any) -> float:
     """计算两个时间字符串/时间戳相差的天数"""
-    def _to_ts(t):
-        if not t: return 0
-        try:
-            if isinstance(t, str) and "-" in t and ":" in t:
-                return datetime.datetime.strptime(str(t), "%Y-%m-%d %H:%M:%S").timestamp()
-            val = float(t)
-            return val / 1000.0 if val > 10000000000 else val
-        except:
-            return 0
-    return (_to_ts(end_str) - _to_ts(start_str)) / 86400.0
+    return (_to_timestamp(end_str) - _to_timestamp(start_str)) / 86400.0
 def _is_large_public_activity(activity: Dict[str, Any]) -> bool:
     """
     判断是否为【大型公共活动】(最终修正版)
     
     判定逻辑 (满足任意一项即为 True):
-    1. [人数维度] 名义容量 > 200
-    2. [人数维度] 实际已报名 > 200 (防止名义容量乱填)
-    3. [时间维度] 活动持续时间 > 30天
-    4. [时间维度] 报名持续时间 > 30天
+    1. [人数维度] 名义容量 > LARGE_ACT_CAPACITY_LIMIT
+    2. [人数维度] 实际已报名 > LARGE_ACT_CAPACITY_LIMIT (防止名义容量乱填)
+    3. [时间维度] 活动持续时间 > LARGE_ACT_DURATION_DAYS 天
+    4. [时间维度] 报名持续时间 > LARGE_ACT_DURATION_DAYS 天
     """
-    # === 1. 定义阈值 (根据你的要求调整) ===
-    CAPACITY_LIMIT = 200        # 人数门槛 (你定义的 200人)
-    DURATION_LIMIT_DAYS = 30    # 时间门槛 (长期活动防骚扰)
+    # === 1. 定义阈值 (见配置 LARGE_ACT_CAPACITY_LIMIT / LARGE_ACT_DURATION_DAYS) ===
+    CAPACITY_LIMIT = LARGE_ACT_CAPACITY_LIMIT        # 人数门槛
+    DURATION_LIMIT_DAYS = LARGE_ACT_DURATION_DAYS    # 时间门槛 (长期活动防骚扰)
 
     # === 2. 安全获取数据 ===
     try:
@@ -667,7 +2129,7 @@ def _is_large_public_activity(activity: Dict[str, Any]) -> bool:
         current_joined = 0
 
     # === 3. [核心判定 A]：人数维度 (使用 OR 逻辑) ===
-    # 只要名义容量或者实际人数超过 200，直接判定为大型活动，立即限流
+    # 只要名义容量或者实际人数超过门槛，直接判定为大型活动，立即限流
     if capacity > CAPACITY_LIMIT or current_joined > CAPACITY_LIMIT:
         return True
 
@@ -757,17 +2219,90 @@ def format_activity_markdown(a: Dict[str, Any], show_detail: bool = True) -> str
     )
 
     return detailed_md
+def _is_join_closing_soon(activity: Dict[str, Any]) -> bool:
+    """[内部辅助] 报名是否将在 REMIND_WINDOW_MIN 分钟内截止"""
+    join_end = _to_timestamp(activity.get("joinEndTime"))
+    if not join_end:
+        return False
+    remain_sec = join_end - time.time()
+    return 0 < remain_sec <= REMIND_WINDOW_MIN * 60
+def _append_join_history(old_state: Dict[str, Any], current_joined: int) -> List[List[int]]:
+    """
+    [内部辅助] 报名人数历史 [[时间戳, 人数], ...]
+    仅在人数变化时追加一个点，超过 JOIN_HISTORY_MAX_POINTS 时丢弃最早的点
+    """
+    history = list(old_state.get("history") or [])
+    if not history or history[-1][1] != current_joined:
+        history.append([int(time.time()), current_joined])
+    return history[-JOIN_HISTORY_MAX_POINTS:]
+def _field_hashes(activity: Dict[str, Any]) -> Dict[str, int]:
+    """[内部辅助] CHANGE_NOTIFY_FIELDS 中每个字段值的 CRC32 (只哈希单个字段值，不序列化整条记录)"""
+    return {field: zlib.crc32(repr(activity.get(field)).encode('utf-8')) for field in CHANGE_NOTIFY_FIELDS}
+def detect_field_changes(activity: Dict[str, Any], old_state: Dict[str, Any]) -> Tuple[Dict[str, int], Set[str], List[str]]:
+    """
+    字段级变更检测：仅比较新旧哈希得到变更字段集合，并生成对应的提醒文案
+    旧状态没有哈希 (新活动或旧版本缓存) 时只建立基线，不产生提醒。
+    :return: (新的字段哈希, 变更字段集合, 提醒文案列表)
+    """
+    new_hashes = _field_hashes(activity)
+    old_hashes = old_state.get("field_hashes")
+    if not old_hashes:
+        return new_hashes, set(), []
+
+    changed = {f for f, h in new_hashes.items() if f in old_hashes and old_hashes[f] != h}
+    lines = []
+
+    if changed & {"joinStartTime", "joinEndTime"}:
+        lines.append(f"🕒 报名时间已变更: {_format_date_mmddhm(activity.get('joinStartTime'))} ~ {_format_date_mmddhm(activity.get('joinEndTime'))}")
+    if changed & {"startTime", "endTime"}:
+        lines.append(f"📅 活动时间已变更: {_format_date_mmddhm(activity.get('startTime'))} ~ {_format_date_mmddhm(activity.get('endTime'))}")
+    if "allowUserCount" in changed:
+        old_capacity = old_state.get("last_capacity")
+        new_capacity = activity.get("allowUserCount")
+        try:
+            expanded = int(new_capacity) > int(old_capacity)
+        except (TypeError, ValueError):
+            expanded = False
+        if expanded:
+            lines.append(f"📣 名额扩容: {old_capacity} → {new_capacity}")
+        else:
+            lines.append(f"📉 名额调整: {old_capacity if old_capacity is not None else '-'} → {new_capacity}")
+    if "statusName" in changed:
+        status_name = activity.get("statusName") or "-"
+        lines.append("✅ 已开始报名" if status_name == "报名中" else f"🔄 状态变更: {status_name}")
+    if changed & {"attachName", "attachTitle"}:
+        lines.append("📎 附件已更新")
+
+    return new_hashes, changed, lines
+def _make_message(text: str, kind: str, group: str, activity: Dict[str, Any], delta: int, show_detail: bool = True) -> Dict[str, Any]:
+    """
+    构建一条待发送消息 (带排序/调度所需的元信息)
+    :param text: 最终推送的 Markdown 文本
+    :param kind: 消息类型 "tribe_new" / "tribe_delta" / "public" / "field_change"
+    :param group: 活动分组 "tribe" / "public" (摘要按 分组+ID 合并同一活动)
+    :param delta: 本次通知对应的新增人数 (用于摘要排序)
+    """
+    return {
+        "text": text,
+        "kind": kind,
+        "group": group,
+        "id": str(activity.get("id")),
+        "delta": delta,
+        "detail": show_detail,
+        "urgent": kind in DIGEST_URGENT_KINDS or _is_join_closing_soon(activity),
+        "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
 
-def process_tribe_activities(new_tribe_list: List[Dict],old_tribe_data: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+@traced("process_tribe_activities")
+def iter_process_tribe_activities(new_tribe_iter: Iterable[Dict],old_tribe_data: Dict[str, Any],updated_tribe_group: Dict[str, Any],emit_events: bool = True) -> Iterator[Dict]:
     """
-    社团活动核心处理器
+    社团活动核心处理器 (流式)
     逻辑：我的社团活动非常重要，不做限流，不做简略。
     只要有变动，全部详细通知。
+    每处理一个活动即产出其消息 (_make_message 字典)，并将新状态写入 updated_tribe_group。
+    emit_events 为 True 时同时写入变更事件日志 (事件日志未开启时无操作)。
     """
-    messages = []
-    updated_tribe_group = {}
-
-    for act in new_tribe_list:
+    for act in new_tribe_iter:
         act_id = str(act.get("id"))
         current_joined = int(act.get("joinUserCount", 0))
 
@@ -782,50 +2317,103 @@ def process_tribe_activities(new_tribe_list: List[Dict],old_tribe_data: Dict[str
         # 计算增量
         delta = current_joined - last_joined
 
+        # 字段级变更 (报名时间/状态/名额/附件等)
+        field_hashes, changed_fields, change_lines = detect_field_changes(act, old_state)
+
+        # --- 变更事件 ---
+        if emit_events:
+            _emit_activity_events("tribe", act, is_new, last_joined, current_joined, changed_fields)
+
         should_notify = False
         header = ""
+        kind = ""
 
         # --- 决策逻辑 ---
         if is_new:
             # 全新社团活动
             should_notify = True
             header = f"🆕 **发现我的社团新活动**"
+            kind = "tribe_new"
 
         elif delta > 0:
             # 人数增加
             should_notify = True
             header = f"📈 **社团活动动态 (新增 +{delta}人)**"
+            kind = "tribe_delta"
+
+        elif change_lines:
+            # 人数没变，但活动信息有变更
+            should_notify = True
+            header = f"🔔 **社团活动信息变更**"
+            kind = "field_change"
 
         # --- 生成消息 (强制详细模式) ---
         if should_notify:
+            if change_lines:
+                header += "\n" + "\n".join(change_lines)
             md = format_activity_markdown(act, show_detail=True)
-            messages.append(f"{header}\n{md}")
+            if emit_events:
+                emit_change_event("notified", "tribe", act_id, kind=kind, detail=True)
+            yield _make_message(f"{header}\n{md}", kind, "tribe", act, max(delta, 0))
 
         # --- 注入状态并保存 ---
-        # 社团活动状态很简单，只需要记录上次人数和时间
+        # 社团活动状态很简单，只需要记录上次人数、人数历史和时间
         act["_state"] = {
             "last_joined": current_joined,
+            "last_capacity": act.get("allowUserCount"),
+            "field_hashes": field_hashes,
+            "history": _append_join_history(old_state, current_joined),
             "update_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
 
         updated_tribe_group[act_id] = act
-
+def process_tribe_activities(new_tribe_list: List[Dict],old_tribe_data: Dict[str, Any]) -> Tuple[List[Dict], Dict[str, Any]]:
+    """
+    列表版本的 iter_process_tribe_activities
+    返回的消息为 _make_message 构建的字典，文本在 "text" 字段。
+    """
+    updated_tribe_group = {}
+    messages = list(iter_process_tribe_activities(new_tribe_list, old_tribe_data, updated_tribe_group))
     return messages, updated_tribe_group
-def process_public_activities(new_public_list: List[Dict],old_public_data: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+def _public_rate_limit(delta: int, is_large: bool, detail_count: int, acc_increase: int,
+                       max_detail: int, batch: int) -> Tuple[bool, bool, int, int, int]:
+    """
+    公共活动限流状态机 (纯函数，阈值由参数传入)
+    :return: (是否通知, 是否详细, 消息中显示的新增人数, 新的详细通知次数, 新的积攒人数)
+    """
+    # 只有人数增加(或新活动)才处理，否则状态不变
+    if delta <= 0:
+        return False, True, delta, detail_count, acc_increase
+
+    if not is_large:
+        # [A] 普通公共活动 -> 总是详细通知，不限流，确保清理积攒
+        return True, True, delta, detail_count, 0
+
+    # [B] 大型公共活动 -> 将本次增量加入积攒池
+    current_acc = acc_increase + delta
+    if detail_count < max_detail:
+        # [阶段1: 详细通知期] 名额没用完 -> 详细通知，消耗1次详细机会并清空积攒
+        return True, True, current_acc, detail_count + 1, 0
+    if current_acc >= batch:
+        # [阶段2: 简略通知期] 名额用完了 -> 积攒够阈值才简略通知
+        return True, False, current_acc, detail_count, 0
+    # 没攒够 -> 静默，只更新积攒数
+    return False, True, delta, detail_count, current_acc
+@traced("process_public_activities")
+def iter_process_public_activities(new_public_iter: Iterable[Dict],old_public_data: Dict[str, Any],updated_public_group: Dict[str, Any],emit_events: bool = True) -> Iterator[Dict]:
     """
-    公共活动核心处理器 (最终版)
+    公共活动核心处理器 (流式)
 
     参数:
-    - new_public_list: 从 API 获取的最新公共活动列表
+    - new_public_iter: 从 API 获取的最新公共活动 (列表或上游生成器)
     - old_public_data: 从本地缓存读取的旧公共活动数据
+    - updated_public_group: 输出参数，写入更新后的完整数据
+    - emit_events: 是否写入变更事件日志 (多用户订阅分发时为 False，避免每个订阅者重复记录)
 
-    返回:
-    - (messages, updated_public_data): 待发送消息列表, 更新后的完整数据
+    产出:
+    - 每个需要通知的活动产出一条 _make_message 字典
     """
-    messages = []
-    updated_public_group = {}
-
-    for act in new_public_list:
+    for act in new_public_iter:
         act_id = str(act.get("id"))
         current_joined = int(act.get("joinUserCount", 0))
 
@@ -840,63 +2428,47 @@ def process_public_activities(new_public_list: List[Dict],old_public_data: Dict[
         # 计算增量 (如果是新活动，last_joined为0，delta即为当前总人数)
         delta = current_joined - last_joined
 
-        # --- 判断活动类型 ---
-        is_large = _is_large_public_activity(act)
-        is_large = True
-
-        # --- 准备新的状态变量 (默认继承旧值) ---
-        new_detail_count = detail_count
-        new_acc_increase = acc_increase
-
-        # --- 决策变量 ---
-        should_notify = False  # 是否发送
-        show_detail = True  # True=详细, False=简略
-        notify_num = delta  # 消息中显示的新增人数
+        # 字段级变更 (报名时间/状态/名额/附件等)，不受大型活动限流影响
+        field_hashes, changed_fields, change_lines = detect_field_changes(act, old_state)
 
-        # 只有人数增加(或新活动)才处理
-        if delta > 0:
-            if not is_large:
-                # [A] 普通公共活动 -> 总是详细通知，不限流
-                should_notify = True
-                show_detail = True
-                notify_num = delta
-                new_acc_increase = 0  # 确保清理积攒
-
-            else:
-                # [B] 大型公共活动 -> 状态机限流逻辑
-                # 将本次增量加入积攒池
-                current_acc = acc_increase + delta
+        # --- 变更事件 ---
+        if emit_events:
+            _emit_activity_events("public", act, act_id not in old_public_data, last_joined, current_joined, changed_fields)
 
-                if detail_count < MAX_LARGE_DETAIL_COUNT:
-                    # [阶段1: 详细通知期] 名额(3次)没用完 -> 详细通知
-                    should_notify = True
-                    show_detail = True
-                    notify_num = current_acc
+        # --- 判断活动类型 ---
+        is_large = LARGE_ACT_FORCE_ALL or _is_large_public_activity(act)
 
-                    new_detail_count += 1  # 消耗1次详细机会
-                    new_acc_increase = 0  # 清空积攒
+        # --- 限流决策 (与离线策略模拟共用同一个状态机) ---
+        should_notify, show_detail, notify_num, new_detail_count, new_acc_increase = _public_rate_limit(
+            delta, is_large, detail_count, acc_increase, MAX_LARGE_DETAIL_COUNT, LARGE_NOTIFY_BATCH)
 
-                else:
-                    # [阶段2: 简略通知期] 名额用完了 -> 积攒够80才简略通知
-                    if current_acc >= LARGE_NOTIFY_BATCH:
-                        should_notify = True
-                        show_detail = False  # 简略模式
-                        notify_num = current_acc
-
-                        new_acc_increase = 0  # 清空积攒
-                    else:
-                        # 没攒够 -> 静默，只更新积攒数
-                        should_notify = False
-                        new_acc_increase = current_acc
+        if delta > 0 and not should_notify and emit_events:
+            # 没攒够 -> 静默，只更新积攒数
+            emit_change_event("suppressed", "public", act_id, delta=delta, acc_increase=new_acc_increase,
+                              threshold=LARGE_NOTIFY_BATCH)
 
         # --- 生成消息 ---
         if should_notify:
             # 统一的消息头
             header = f"🔥 ***火热报名中 (新增 +{notify_num}人)***"
+            if change_lines:
+                # 有字段变更时总是给出详细卡片
+                header += "\n" + "\n".join(change_lines)
+                show_detail = True
 
             # 调用 Markdown 生成函数 (根据 show_detail 决定繁简)
             md = format_activity_markdown(act, show_detail=show_detail)
-            messages.append(f"{header}\n{md}")
+            if emit_events:
+                emit_change_event("notified", "public", act_id, kind="public", detail=show_detail, notify_num=notify_num)
+            yield _make_message(f"{header}\n{md}", "public", "public", act, notify_num, show_detail)
+
+        elif change_lines:
+            # 人数未触发通知，但活动信息有变更
+            header = "🔔 ***活动信息变更***\n" + "\n".join(change_lines)
+            md = format_activity_markdown(act, show_detail=True)
+            if emit_events:
+                emit_change_event("notified", "public", act_id, kind="field_change", detail=True)
+            yield _make_message(f"{header}\n{md}", "field_change", "public", act, 0)
 
         # --- 注入状态并保存 (构建 updated_public_data) ---
         act["_state"] = {
@@ -904,13 +2476,27 @@ def process_public_activities(new_public_list: List[Dict],old_public_data: Dict[
             "detail_count": new_detail_count,
             "acc_increase": new_acc_increase,
             "is_large": is_large,
+            "last_capacity": act.get("allowUserCount"),
+            "field_hashes": field_hashes,
+            "history": _append_join_history(old_state, current_joined),
             "update_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
 
         updated_public_group[act_id] = act
+def process_public_activities(new_public_list: List[Dict],old_public_data: Dict[str, Any]) -> Tuple[List[Dict], Dict[str, Any]]:
+    """
+    公共活动核心处理器 (列表版本)
 
+    返回:
+    - (messages, updated_public_data): 待发送消息列表 (_make_message 字典), 更新后的完整数据
+    """
+    updated_public_group = {}
+    messages = list(iter_process_public_activities(new_public_list, old_public_data, updated_public_group))
     return messages, updated_public_group
 
+def _is_in_run_window(now: datetime.datetime) -> bool:
+    """[内部辅助] 当前时间是否处于每日运行窗口 (RUN_WINDOW_START ~ RUN_WINDOW_END)"""
+    return RUN_WINDOW_START <= now.time() <= RUN_WINDOW_END
 def check_run_conditions(cache_data: Dict[str, Any]) -> Tuple[bool, bool]:
     """
     调度检查器
@@ -926,10 +2512,7 @@ def check_run_conditions(cache_data: Dict[str, Any]) -> Tuple[bool, bool]:
     current_time = now.time()
 
     # === 1. 全局时间窗口检查 (07:30 ~ 22:00) ===
-    start_time = datetime.time(7, 30)
-    end_time = datetime.time(22, 0)
-
-    if not (start_time <= current_time <= end_time):
+    if not _is_in_run_window(now):
         log(f"💤 当前时间 {current_time.strftime('%H:%M')} 不在运行窗口 (07:30-22:00)，脚本休眠。")
         return False, False
 
@@ -966,81 +2549,1577 @@ def check_run_conditions(cache_data: Dict[str, Any]) -> Tuple[bool, bool]:
 
     return run_tribe, run_public
 
-if __name__ == "__main__":
+def _digest_rank(entry: Dict[str, Any]) -> Tuple[int, int]:
+    """[内部辅助] 摘要排序键：社团新活动优先，其余按新增人数从大到小"""
+    return (0 if entry.get("kind") == "tribe_new" else 1, -int(entry.get("delta", 0)))
+def _digest_key(entry: Dict[str, Any]) -> Tuple[str, str]:
+    """[内部辅助] 摘要合并键 (分组, 活动ID)；旧版本缓存中的消息没有 group 字段，按消息类型推断"""
+    group = entry.get("group") or ("tribe" if str(entry.get("kind", "")).startswith("tribe") else "public")
+    return group, str(entry.get("id"))
+def enqueue_digest(digest_state: Dict[str, Any], entries: List[Dict]) -> List[Dict]:
+    """
+    将本次产生的消息放入摘要缓冲区
+    1. 紧急消息 (urgent) 不进缓冲区，直接返回给调用方立即推送 (运行窗口外除外)，
+       缓冲区中同一活动的旧消息随之作废。
+    2. 同一活动 (分组+ID) 在缓冲区中只保留一条：文本取最新，新增人数累加用于排序；
+       若其中有"社团新活动"，合并后仍按新活动排序并保留新活动标题。
+
+    :param digest_state: 缓存中的摘要状态 {"pending": [...], "last_flush": "..."}
+    :return: 需要立即推送的紧急消息
+    """
+    pending = digest_state.setdefault("pending", [])
+    in_window = _is_in_run_window(datetime.datetime.now())
+    urgent = []
+
+    for entry in entries:
+        key = _digest_key(entry)
+        index = next((i for i, old in enumerate(pending) if _digest_key(old) == key), None)
+
+        if entry.get("urgent") and in_window:
+            urgent.append(entry)
+            if index is not None:
+                pending.pop(index)
+            continue
+
+        if index is None:
+            pending.append(entry)
+            continue
+
+        # 合并同一活动的旧消息 (保留最新文本，累加增量)
+        old = pending[index]
+        merged = dict(entry, delta=int(old.get("delta", 0)) + int(entry.get("delta", 0)),
+                      group=key[0], created=old.get("created", entry.get("created")))
+        if old.get("kind") == "tribe_new" and entry.get("kind") != "tribe_new":
+            merged["kind"] = "tribe_new"
+            merged["text"] = "🆕 **发现我的社团新活动**\n" + entry["text"]
+        pending[index] = merged
+
+    return urgent
+def should_flush_digest(digest_state: Dict[str, Any], now: Optional[datetime.datetime] = None) -> bool:
+    """
+    摘要推送判定：
+    1. 运行窗口外一律不推送 (夜间消息顺延到早上)。
+    2. 今天还没推送过 -> 早上第一次运行时推送 (合并夜间积攒)。
+    3. 距上次推送超过 DIGEST_INTERVAL_MIN，或条数/字数超过预算 -> 推送。
+    """
+    now = now or datetime.datetime.now()
+    pending = digest_state.get("pending") or []
+    if not pending or not _is_in_run_window(now):
+        return False
+
+    if len(pending) >= DIGEST_MAX_ITEMS:
+        return True
+    if sum(len(e.get("text", "")) for e in pending) >= DIGEST_MAX_CHARS:
+        return True
+
     try:
-        # ---------------- Step 1: 读取本地缓存 ----------------
-        full_cache_data = load_data()
+        last_flush = datetime.datetime.strptime(digest_state.get("last_flush", ""), "%Y-%m-%d %H:%M:%S")
+    except:
+        return True
 
-        old_tribe_data = full_cache_data.get("tribe", {})
-        old_public_data = full_cache_data.get("public", {})
+    if last_flush.date() != now.date():
+        return True
+    return (now - last_flush).total_seconds() / 60 >= DIGEST_INTERVAL_MIN
+def flush_digest(digest_state: Dict[str, Any]) -> List[str]:
+    """取出缓冲区内全部消息，按重要程度排序，返回待推送文本并清空缓冲区"""
+    pending = sorted(digest_state.get("pending") or [], key=_digest_rank)
+    digest_state["pending"] = []
+    digest_state["last_flush"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if not pending:
+        return []
 
-        # ---------------- Step 2: 调度检查 (决定跑什么) ----------------
-        do_run_tribe, do_run_public = check_run_conditions(full_cache_data)
+    log(f"🗞️ 摘要推送: 共 {len(pending)} 条积攒消息")
+    header = f"🗞️ ***活动摘要 ({len(pending)} 条)***"
+    return [header] + [e["text"] for e in pending]
+class MessageOutbox:
+    """
+    消息出口：处理器每产生一条消息就立即放入出口，而不是等全部处理完再汇总。
+    出口本身从不发送：所有消息都在 close() 时返回，由主流程先保存数据再统一推送，
+    保证中途出错时不会出现"已推送但状态未保存、下次重复推送"。
+    - 未开启摘要：全部消息在本次运行结束后推送 (原有行为)。
+    - 开启摘要：紧急消息本次运行结束后即推送，其余进入摘要缓冲区，close() 时判定是否到期。
+    """
 
-        # 如果全都不需要跑，直接退出，极致省流
-        if not do_run_tribe and not do_run_public:
-            print("💤 所有任务均未达到执行间隔，脚本结束。")
-            exit(0)
+    def __init__(self, cache_data: Dict[str, Any]):
+        self.cache_data = cache_data
+        self.buffer: List[str] = []
+        self.total = 0
 
-        # ---------------- Step 3: 按需请求数据 ----------------
-        # 只请求需要执行的部分，减少封号风险
-        new_tribe_acts, new_public_acts = fetch_target_activities_by_mode(enable_tribe=do_run_tribe,enable_public=do_run_public)
+    def put(self, entry: Dict[str, Any]):
+        self.total += 1
 
-        # 准备收集的消息列表 (这是要发给客户端的干货)
-        all_messages = []
+        if DIGEST_ENABLED:
+            digest_state = self.cache_data.setdefault("digest", {"pending": [], "last_flush": ""})
+            self.buffer.extend(e["text"] for e in enqueue_digest(digest_state, [entry]))
+            return
 
-        # 准备用于保存的数据 (默认为旧数据)
-        final_tribe_data = old_tribe_data
-        final_public_data = old_public_data
+        self.buffer.append(entry["text"])
 
-        # 获取当前时间
-        now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def close(self) -> List[str]:
+        """结束本次运行，返回需要推送的文本 (紧急消息在前)"""
+        remaining, self.buffer = self.buffer, []
+        if not DIGEST_ENABLED:
+            return remaining
 
-        # ---------------- Step 4: 执行业务逻辑 ----------------
+        digest_state = self.cache_data.setdefault("digest", {"pending": [], "last_flush": ""})
+        if should_flush_digest(digest_state):
+            return remaining + flush_digest(digest_state)
+        if digest_state.get("pending"):
+            log(f"📥 摘要缓冲中: {len(digest_state['pending'])} 条消息待推送")
+        return remaining
 
-        # === A. 处理社团活动 ===
-        if do_run_tribe:
-            print(f"\n⚡ 分析社团数据变动...")
-            # 这里的 process 函数只会返回 mkdown 数据，不含 log
-            t_msgs, final_tribe_data = process_tribe_activities(new_tribe_acts, old_tribe_data)
-            all_messages.extend(t_msgs)
+# ------------------------------------------------------------------------------
+# 相似活动合并 (MinHash 签名 + LSH 分桶)
+# ------------------------------------------------------------------------------
+# 每个签名按段切分，段内容的哈希作为桶键；两个活动只要有一段完全相同就会落入同一个桶。
+# 查询只比较同桶的候选，耗时与缓存中的活动总数无关。
+_MINHASH_PRIME = (1 << 31) - 1
 
-            # 更新运行时间
-            full_cache_data["tribe_last_run"] = now_str
 
-        # === B. 处理公共活动 ===
-        if do_run_public:
-            print(f"\n⚡ 分析公共数据变动...")
-            p_msgs, final_public_data = process_public_activities(new_public_acts, old_public_data)
-            all_messages.extend(p_msgs)
-
-            # 更新运行时间
-            full_cache_data["public_last_run"] = now_str
-
-        # ---------------- Step 5: 保存数据 ----------------
-        # 先保存状态，防止发送消息出错导致数据回滚
-        data_to_save = {
-            "tribe_last_run": full_cache_data.get("tribe_last_run", ""),
-            "public_last_run": full_cache_data.get("public_last_run", ""),
-            "tribe": final_tribe_data,
-            "public": final_public_data
+class NearDuplicateIndex:
+    """
+    近似重复索引，状态保存在缓存的 "dedup" 字段 (原地修改):
+    {"params": [...], "texts": {id: 文本哈希}, "signatures": {id: [...]},
+     "buckets": {"段号:哈希": [id, ...]}, "cluster": {成员 id: 代表 id}, "clusters": {代表 id: [成员 id, ...]}}
+    只有存在相似活动时才会出现在 cluster / clusters 中。
+    """
+
+    def __init__(self, state: Dict[str, Any]):
+        params = [DEDUP_NUM_PERM, DEDUP_BANDS, DEDUP_SHINGLE, DEDUP_MAX_CHARS]
+        if state.get("params") != params:
+            # 参数变化后旧签名不可比较，重建索引
+            state.clear()
+            state["params"] = params
+        self.texts: Dict[str, int] = state.setdefault("texts", {})
+        self.signatures: Dict[str, List[int]] = state.setdefault("signatures", {})
+        self.buckets: Dict[str, List[str]] = state.setdefault("buckets", {})
+        self.cluster: Dict[str, str] = state.setdefault("cluster", {})
+        self.clusters: Dict[str, List[str]] = state.setdefault("clusters", {})
+
+        rng = random.Random(20240601)  # 固定种子：签名跨运行可比较
+        self.perms = [(rng.randrange(1, _MINHASH_PRIME), rng.randrange(0, _MINHASH_PRIME)) for _ in range(DEDUP_NUM_PERM)]
+        self.rows = max(1, DEDUP_NUM_PERM // DEDUP_BANDS)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    @staticmethod
+    def _normalize(activity: Dict[str, Any]) -> str:
+        """名称+介绍，去掉数字/空白/标点：场次号、班级号、日期不同不影响相似度"""
+        text = f"{activity.get('name') or ''}{activity.get('description') or ''}"
+        return re.sub(r"[\d\W_]+", "", text)[:DEDUP_MAX_CHARS]
+
+    def signature(self, text: str) -> List[int]:
+        k = DEDUP_SHINGLE
+        shingles = {zlib.crc32(text[i:i + k].encode('utf-8')) for i in range(max(1, len(text) - k + 1))}
+        return [min((a * h + b) % _MINHASH_PRIME for h in shingles) for a, b in self.perms]
+
+    def _band_keys(self, signature: List[int]) -> List[str]:
+        r = self.rows
+        return [f"{band}:{zlib.crc32(repr(signature[band * r:(band + 1) * r]).encode('utf-8'))}"
+                for band in range(len(signature) // r)]
+
+    @staticmethod
+    def similarity(a: List[int], b: List[int]) -> float:
+        """签名中相同位置取值相等的比例 (Jaccard 相似度的估计)"""
+        return sum(x == y for x, y in zip(a, b)) / max(len(a), 1)
+
+    def add(self, activity: Dict[str, Any]) -> str:
+        """
+        加入 (或更新) 一个活动
+        :return: 所属相似簇的代表活动 ID (没有相似活动时为自身)
+        """
+        act_id = str(activity.get("id"))
+        text = self._normalize(activity)
+        if len(text) < DEDUP_SHINGLE:
+            # 去掉数字/标点后几乎没有文字 (如纯编号的名称)：所有这类活动的签名都相同，不参与合并
+            if act_id in self.signatures:
+                self.remove(act_id)
+            return act_id
+        text_hash = zlib.crc32(text.encode('utf-8'))
+        if self.texts.get(act_id) == text_hash:
+            return self.cluster.get(act_id, act_id)
+        if act_id in self.signatures:
+            self.remove(act_id)
+
+        signature = self.signature(text)
+        keys = self._band_keys(signature)
+        best, best_sim = None, DEDUP_THRESHOLD
+        for candidate in {c for key in keys for c in self.buckets.get(key, ())}:
+            sim = self.similarity(signature, self.signatures[candidate])
+            if sim >= best_sim:
+                best, best_sim = candidate, sim
+
+        self.texts[act_id] = text_hash
+        self.signatures[act_id] = signature
+        for key in keys:
+            self.buckets.setdefault(key, []).append(act_id)
+        if best is None:
+            return act_id
+
+        canonical = self.cluster.get(best, best)
+        self.cluster[act_id] = canonical
+        self.clusters.setdefault(canonical, [canonical]).append(act_id)
+        return canonical
+
+    def remove(self, act_id: str):
+        """移出索引；移除的是代表活动时，由簇内下一个成员接替"""
+        signature = self.signatures.pop(act_id, None)
+        self.texts.pop(act_id, None)
+        if signature is None:
+            return
+        for key in self._band_keys(signature):
+            bucket = self.buckets.get(key)
+            if bucket and act_id in bucket:
+                bucket.remove(act_id)
+                if not bucket:
+                    del self.buckets[key]
+
+        # 簇成员列表的第一个总是代表活动
+        canonical = self.cluster.pop(act_id, act_id)
+        members = [m for m in self.clusters.pop(canonical, []) if m != act_id]
+        for m in members:
+            self.cluster.pop(m, None)
+        if len(members) >= 2:
+            self.clusters[members[0]] = members
+            for m in members[1:]:
+                self.cluster[m] = members[0]
+
+    def prune(self, keep_ids: Iterable[str]):
+        """移除不在 keep_ids 中的活动 (已结束/消失的活动)"""
+        keep = set(keep_ids)
+        for act_id in [i for i in self.signatures if i not in keep]:
+            self.remove(act_id)
+
+    def cluster_size(self, canonical: str) -> int:
+        return len(self.clusters.get(canonical, [canonical]))
+def merge_duplicate_entries(items: List[Tuple[Dict[str, Any], Dict[str, Any]]], cluster_size: int) -> Dict[str, Any]:
+    """
+    将同一相似簇本次产生的消息合并为一条：人数增加最多的场次给出完整卡片，其余场次各列一行
+    :param items: [(消息, 活动)]
+    :param cluster_size: 该簇在索引中的活动总数 (含本次没有变化的场次)
+    """
+    if len(items) == 1:
+        entry = items[0][0]
+        if cluster_size > 1:
+            entry = dict(entry, text=entry["text"] + f"\n🧬 另有 {cluster_size - 1} 个相似场次")
+        return entry
+
+    items = sorted(items, key=lambda x: -int(x[0].get("delta", 0)))
+    lead = items[0][0]
+    lines = [f"🧬 ***相似活动 {len(items)} 场 (已合并通知)***", lead["text"], "", "*其他场次：*"]
+    for entry, act in items[1:]:
+        lines.append(f"- {act.get('name')} | 开始 {_format_date_mmddhm(act.get('startTime'))} | "
+                     f"已报名 {act.get('joinUserCount')}/{act.get('allowUserCount')} (+{entry.get('delta', 0)})")
+    if cluster_size > len(items):
+        lines.append(f"- 另有 {cluster_size - len(items)} 个相似场次无变化")
+    return dict(lead, text="\n".join(lines),
+                delta=sum(int(e.get("delta", 0)) for e, _ in items),
+                urgent=any(e.get("urgent") for e, _ in items))
+
+# ------------------------------------------------------------------------------
+# 多用户订阅 (一个监控实例服务多个不同画像的订阅者)
+# ------------------------------------------------------------------------------
+class SubscriptionIndex:
+    """
+    订阅者倒排索引：
+    - 学院 ID -> 订阅者集合
+    - 年级 ID -> 订阅者集合
+    - 屏蔽关键词 -> 订阅者集合 (再按关键词前 1~2 个字索引，扫描标题时只校验候选词)
+    匹配一个活动时只访问限制条件对应的集合，开销与命中的订阅者数量成正比，而不是与订阅者总数成正比。
+    订阅仅作用于公共活动；社团活动依赖各自的 Token，不在此范围内。
+    """
+
+    def __init__(self, profiles: Iterable[Dict[str, Any]] = ()):
+        self.profiles: Dict[str, Dict[str, Any]] = {}
+        self.all_ids: Set[str] = set()
+        self.by_college: Dict[Any, Set[str]] = {}
+        self.by_year: Dict[Any, Set[str]] = {}
+        self.by_keyword: Dict[str, Set[str]] = {}
+        self._keyword_prefix: Dict[str, Set[str]] = {}
+        for profile in profiles:
+            self.add(profile)
+
+    def add(self, profile: Dict[str, Any]):
+        sid = str(profile["id"])
+        self.profiles[sid] = profile
+        self.all_ids.add(sid)
+
+        college_id = profile.get("college_id")
+        if college_id is not None:
+            self.by_college.setdefault(college_id, set()).add(sid)
+        for year_id in profile.get("allow_years") or []:
+            self.by_year.setdefault(year_id, set()).add(sid)
+        for keyword in profile.get("filter_keywords") or []:
+            if not keyword:
+                continue
+            self.by_keyword.setdefault(keyword, set()).add(sid)
+            self._keyword_prefix.setdefault(keyword[:2], set()).add(keyword)
+
+    def __len__(self):
+        return len(self.all_ids)
+
+    def _blocked_by_keywords(self, name: str) -> Set[str]:
+        """标题中出现的屏蔽词 -> 屏蔽该活动的订阅者"""
+        blocked = set()
+        if not self._keyword_prefix or not name:
+            return blocked
+        for i in range(len(name)):
+            for prefix in (name[i:i + 1], name[i:i + 2]):
+                for keyword in self._keyword_prefix.get(prefix, ()):
+                    if name.startswith(keyword, i):
+                        blocked |= self.by_keyword[keyword]
+        return blocked
+
+    @staticmethod
+    def _union(index: Dict[Any, Set[str]], keys: Iterable[Any]) -> Set[str]:
+        result = set()
+        for key in keys:
+            result |= index.get(key, set())
+        return result
+
+    def match(self, activity: Dict[str, Any]) -> Set[str]:
+        """
+        返回对该活动感兴趣的订阅者 ID 集合
+        活动需带有 _allowCollegeIds / _allowYearIds (iter_fetch_and_clean_data(filter_profile=False) 的输出)
+        """
+        college_ids = activity.get("_allowCollegeIds") or []
+        year_ids = activity.get("_allowYearIds") or []
+
+        candidates = None
+        if college_ids:
+            candidates = self._union(self.by_college, college_ids)
+        if year_ids:
+            year_set = self._union(self.by_year, year_ids)
+            if candidates is None:
+                candidates = year_set
+            else:
+                small, large = sorted((candidates, year_set), key=len)
+                candidates = {sid for sid in small if sid in large}
+        if candidates is None:
+            candidates = self.all_ids
+
+        blocked = self._blocked_by_keywords(activity.get("name") or "")
+        return candidates - blocked if blocked else set(candidates)
+def load_subscribers() -> List[Dict[str, Any]]:
+    """读取订阅者列表 (SUBSCRIBERS_FILE)，文件不存在或损坏时返回空列表"""
+    if not os.path.exists(SUBSCRIBERS_FILE):
+        log(f"⚠️ 未找到订阅者文件: {SUBSCRIBERS_FILE}")
+        return []
+    try:
+        with open(SUBSCRIBERS_FILE, 'r', encoding='utf-8') as f:
+            profiles = json.load(f)
+        return [p for p in profiles if isinstance(p, dict) and p.get("id") is not None]
+    except Exception as e:
+        log(f"⚠️ 订阅者文件解析失败: {e}")
+        return []
+def load_subscription_state() -> Dict[str, Dict[str, Any]]:
+    """读取订阅者状态 {订阅者ID: {活动ID: {"_state": {...}}}} (经协同后端，多节点共享)"""
+    return get_backend().load_state("subscriptions")
+def save_subscription_state(state: Dict[str, Dict[str, Any]]) -> bool:
+    """保存订阅者状态，返回是否成功"""
+    try:
+        get_backend().save_state("subscriptions", state)
+        return True
+    except Exception as e:
+        print(f"❌ 保存订阅状态失败: {e}")
+        return False
+def fan_out_subscriptions(index: SubscriptionIndex, act: Dict[str, Any], old_state: Dict[str, Dict[str, Any]],
+                          new_state: Dict[str, Dict[str, Any]], outboxes: Dict[str, List[str]]):
+    """
+    把一个公共活动分发给所有匹配的订阅者：
+    每个订阅者用自己的 _state 独立走一遍 process_public_activities 的限流逻辑，
+    消息写入各自的消息流，状态只保存 _state (不重复保存活动全文)。
+    """
+    act_id = str(act.get("id"))
+    for sid in index.match(act):
+        group = new_state.setdefault(sid, {})
+        for entry in iter_process_public_activities([dict(act)], old_state.get(sid, {}), group, emit_events=False):
+            outboxes.setdefault(sid, []).append(entry["text"])
+        group[act_id] = {"_state": group[act_id]["_state"]}
+def send_subscription_messages(index: SubscriptionIndex, outboxes: Dict[str, List[str]]):
+    """按订阅者分别推送各自的消息流"""
+    for sid, messages in outboxes.items():
+        profile = index.profiles.get(sid, {})
+        log(f"👤 订阅者 [{sid}] 本次 {len(messages)} 条消息")
+        send_messages(messages, push_url=profile.get("push_url") or "")
+
+# ------------------------------------------------------------------------------
+# 报名开放监视 (高频轮询即将开放报名的活动)
+# ------------------------------------------------------------------------------
+class RateLimiter:
+    """令牌桶限速：平均速率 rate 次/秒，最多积攒 burst 个令牌"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = max(rate, 0.001)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+def collect_watch_targets(cache_data: Dict[str, Any], now: float, horizon_sec: float, alerted: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    从缓存中挑出需要监视的活动：joinStartTime 落在 (now - 宽限期, now + horizon] 内，
+    且开始报名时间处于运行窗口内、尚未提醒过
+    """
+    targets = []
+    for group in ("tribe", "public"):
+        for act_id, record in (cache_data.get(group) or {}).items():
+            if act_id in alerted:
+                continue
+            join_start = _to_timestamp(record.get("joinStartTime"))
+            if not join_start or not (now - WATCH_GIVE_UP_SEC < join_start <= now + horizon_sec):
+                continue
+            if not _is_in_run_window(datetime.datetime.fromtimestamp(join_start)):
+                continue
+            targets.append({"key": act_id, "id": record.get("id") or act_id, "group": group, "name": record.get("name"), "join_start": join_start,
+                            "_source_type": record.get("_source_type")})
+    return sorted(targets, key=lambda t: t["join_start"])
+def _registration_outcome(info: Dict[str, Any], join_start: float) -> Optional[str]:
+    """[内部辅助] 根据最新详情判断 "full" (已满) / "open" (已开放)，否则 None"""
+    try:
+        joined = int(info.get("joinUserCount") or 0)
+        capacity = int(info.get("allowUserCount") or 0)
+    except (TypeError, ValueError):
+        joined, capacity = 0, 0
+    if capacity > 0 and joined >= capacity:
+        return "full"
+    if info.get("statusName") == "报名中":
+        return "open"
+    if time.time() >= join_start and joined > 0:
+        return "open"
+    return None
+def load_watch_state() -> Dict[str, Any]:
+    """读取已提醒过的活动 {活动ID: {"outcome", "time", "join_start"}} (经协同后端，多节点共享)"""
+    return get_backend().load_state("watch")
+def prune_watch_state(alerted: Dict[str, Any], now: float) -> Dict[str, Any]:
+    """
+    清理已不可能再被监视的记录 (报名开始时间早于 now - WATCH_GIVE_UP_SEC)，避免状态文件无限增长
+    旧版本记录没有 join_start，按提醒时间推断 (提醒最早发生在报名开始前 horizon + lead 秒)
+    """
+    keep_after = now - WATCH_GIVE_UP_SEC
+    legacy_keep_after = keep_after - WATCH_HORIZON_MIN * 60 - WATCH_LEAD_SEC
+    pruned = {}
+    for key, entry in alerted.items():
+        if entry.get("join_start") is not None:
+            if entry["join_start"] >= keep_after:
+                pruned[key] = entry
+        elif _to_timestamp(entry.get("time")) >= legacy_keep_after:
+            pruned[key] = entry
+    return pruned
+def save_watch_state(alerted: Dict[str, Any]):
+    """写回提醒记录 (本地文件后端原子写入)"""
+    get_backend().save_state("watch", alerted)
+def _watch_lock_ttl() -> float:
+    """[内部辅助] 监视锁有效期：超过该时长未续约视为失效 (运行中的进程每次重新扫描时续约)"""
+    return WATCH_RESCAN_SEC * 3 + REQUEST_TIMEOUT * MAX_RETRIES
+def run_watcher(args: argparse.Namespace):
+    """
+    watch 子命令：
+    1. 从缓存挑出即将开始报名的活动，在 joinStartTime - WATCH_LEAD_SEC 时开始轮询其详情。
+    2. 所有请求共用一个令牌桶 (WATCH_MAX_RPS)，到期最早的活动优先，开放集中时轮询间隔自动拉长。
+    3. 检测到开放或已满时立即推送 (不进入摘要)，该活动停止轮询。
+    4. 运行期间每 WATCH_RESCAN_SEC 秒重新扫描缓存，新进入监视范围的活动即时加入；
+       没有待轮询的活动且重新扫描也没有新活动时退出。
+    """
+    horizon_sec = (args.horizon if args.horizon is not None else WATCH_HORIZON_MIN) * 60
+    interval = args.interval if args.interval is not None else WATCH_POLL_INTERVAL_SEC
+    limiter = RateLimiter(args.rps if args.rps is not None else WATCH_MAX_RPS)
+
+    # 监视锁经协同后端：单机为锁文件，多节点共用一个 KV 租约，整个集群只有一个监视进程
+    backend = get_backend()
+    try:
+        locked = backend.acquire_lease("watch", ttl=_watch_lock_ttl())
+    except Exception as e:
+        log(f"❌ 协同后端不可用，本次跳过: {e}")
+        return
+    if not locked:
+        log("💤 已有报名监视进程在运行，本次退出")
+        return
+
+    try:
+        alerted = prune_watch_state(load_watch_state(), time.time())
+
+        # 小顶堆: (下次轮询时间, 序号, 目标)
+        heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        watching: Set[str] = set()
+        seq = 0
+        requests_made = 0
+        next_scan = 0.0
+
+        while True:
+            now = time.time()
+            scanned = now >= next_scan
+            if scanned:
+                if not backend.acquire_lease("watch", ttl=_watch_lock_ttl()):
+                    log("⚠️ 监视锁已被其他进程接管，本次退出")
+                    break
+                new_targets = [t for t in collect_watch_targets(load_data(), now, horizon_sec, alerted)
+                               if t["key"] not in watching]
+                for target in new_targets:
+                    heapq.heappush(heap, (max(target["join_start"] - WATCH_LEAD_SEC, now), seq, target))
+                    watching.add(target["key"])
+                    seq += 1
+                if new_targets:
+                    log(f"👀 报名监视: 新增 {len(new_targets)} 个活动，共 {len(heap)} 个待轮询 "
+                        f"(间隔 {interval}s, 限速 {limiter.rate}/s)")
+                next_scan = now + WATCH_RESCAN_SEC
+
+            if not heap:
+                if scanned:
+                    break
+                # 退出前再扫描一次，避免刚进入范围的活动要等下一次 cron
+                next_scan = 0.0
+                continue
+
+            wait = min(heap[0][0], next_scan) - now
+            if wait > 0:
+                time.sleep(wait)
+                continue
+
+            _, _, target = heapq.heappop(heap)
+            limiter.acquire()
+            info = fetch_activity_detail(target["id"])
+            requests_made += 1
+            now = time.time()
+
+            outcome = _registration_outcome(info, target["join_start"]) if info else None
+            if outcome:
+                act = _extract_required_fields(info, target["id"])
+                if target.get("_source_type"):
+                    act["_source_type"] = target["_source_type"]
+                clean_activity_descriptions([act])
+                latency = now - target["join_start"]
+                header = "🈵 ***名额已满***" if outcome == "full" else "⏰ ***报名已开放***"
+                log(f"🚨 {target['name']} {'已满' if outcome == 'full' else '已开放'} (距报名开始 {latency:+.0f}s)")
+
+                # 先记录再推送：写入失败时宁可漏报一次，也不在每次重启后重复提醒
+                alerted[target["key"]] = {"outcome": outcome, "join_start": target["join_start"],
+                                          "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+                alerted = prune_watch_state(alerted, now)
+                save_watch_state(alerted)
+                send_messages([f"{header}\n{format_activity_markdown(act, show_detail=True)}"])
+                continue
+
+            if now > target["join_start"] + WATCH_GIVE_UP_SEC:
+                log(f"⌛ {target['name']} 报名开始后 {WATCH_GIVE_UP_SEC}s 仍未开放，停止监视")
+                continue
+
+            heapq.heappush(heap, (now + interval, seq, target))
+            seq += 1
+
+        if requests_made:
+            log(f"✅ 报名监视结束，共请求 {requests_made} 次")
+        else:
+            log("💤 未来一段时间内没有即将开放报名的活动")
+    finally:
+        backend.release_lease("watch")
+
+# ------------------------------------------------------------------------------
+# 离线基准测试 (python main.py bench <suite>，不发送任何网络请求)
+# ------------------------------------------------------------------------------
+def _bench_timer(func, *args, **kwargs) -> Tuple[Any, float]:
+    """[内部辅助] 执行一次并返回 (结果, 耗时毫秒)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+def bench_subscriptions(args: argparse.Namespace):
+    """订阅匹配基准：倒排索引 vs 逐个订阅者线性扫描"""
+    rng = random.Random(args.seed)
+    colleges = list(range(1001, 1041))
+    years = list(range(2019, 2026))
+    words = [f"词{i}" for i in range(300)]
+
+    profiles = [{
+        "id": f"u{i}",
+        "college_id": rng.choice(colleges),
+        "allow_years": rng.sample(years, rng.randint(1, 2)),
+        "filter_keywords": rng.sample(words, rng.randint(0, 3)),
+    } for i in range(args.profiles)]
+
+    activities = [{
+        "id": i,
+        "name": "活动" + "".join(rng.sample(words, 3)),
+        "_allowCollegeIds": rng.sample(colleges, rng.randint(1, 3)) if rng.random() < 0.6 else [],
+        "_allowYearIds": rng.sample(years, rng.randint(1, 2)) if rng.random() < 0.5 else [],
+    } for i in range(args.activities)]
+
+    def naive_match(act):
+        return {str(p["id"]) for p in profiles
+                if check_profile_restrictions(act["_allowCollegeIds"], act["_allowYearIds"], p["allow_years"], p["college_id"]) is None
+                and not any(k in act["name"] for k in p["filter_keywords"])}
+
+    index, build_ms = _bench_timer(SubscriptionIndex, profiles)
+    results, index_ms = _bench_timer(lambda: [index.match(a) for a in activities])
+
+    sample = activities[:min(50, len(activities))]
+    naive_results, naive_ms = _bench_timer(lambda: [naive_match(a) for a in sample])
+    if naive_results != results[:len(sample)]:
+        log("❌ 倒排索引与线性扫描结果不一致")
+
+    avg_hits = sum(len(r) for r in results) / max(len(results), 1)
+    index_avg = index_ms / max(len(activities), 1)
+    naive_avg = naive_ms / max(len(sample), 1)
+    log(f"🏁 订阅匹配基准: 订阅者 {len(profiles)} | 活动 {len(activities)}")
+    log(f"   建索引: {build_ms:.1f} ms")
+    log(f"   倒排索引匹配: 平均 {index_avg:.3f} ms/活动 (平均命中 {avg_hits:.0f} 人)")
+    log(f"   线性扫描匹配: 平均 {naive_avg:.3f} ms/活动 (抽样 {len(sample)} 个)")
+    log(f"   加速比: {naive_avg / index_avg if index_avg else float('inf'):.1f}x")
+
+class SyntheticDataset:
+    """
+    确定性合成数据 (同一 seed 结果完全相同)，字段形态与真实接口一致：
+    - list_payload():        /activity/list 响应 (全局列表，status=3 时为已结束列表)
+    - detail_payload(id):    /activity/info 响应 {"data": {"baseInfo": {...}}}
+    - tribe_list_payload():  /tribe/myList 响应 (支持 page / limit 分页)
+    - event_list_payload(t): /tribe/eventList 响应 (支持 page / limit 分页)
+    - cache:                 load_data() 结构的历史缓存 (含 _state)，条目数为 n_cache
+    post(url, payload) 按 URL 分发，可替代 safe_post_request 做完全离线的回放。
+    """
+
+    _TOPICS = ["人工智能", "心理健康", "职业规划", "安全教育", "创新创业", "志愿服务", "校园跑", "读书分享", "英语角", "书法"]
+    _KINDS = ["讲座", "培训", "比赛", "分享会", "招新", "社会实践", "志愿活动"]
+    _STATUS = ["报名中", "报名中", "报名中", "未开始", "进行中", "已结束"]
+
+    def __init__(self, seed: int = 42, n_public: int = 1000, n_tribes: int = 20, events_per_tribe: int = 4, n_cache: int = 0):
+        self.rng = random.Random(seed)
+        self.base_ts = datetime.datetime(2026, 3, 1, 8, 0).timestamp()
+        self.colleges = [100 + i for i in range(30)]
+        self.years = list(ALLOW_YEARS) + [2000 + i for i in range(6)]
+        self.keywords = [f"{t}{k}" for t in self._TOPICS[:3] for k in self._KINDS[:2]]
+
+        self.details: Dict[int, Dict[str, Any]] = {}
+        self.public_ids = [self._new_activity(10_000 + i) for i in range(n_public)]
+        self.tribes = [{"id": 500 + t, "name": f"{self.rng.choice(self._TOPICS)}协会{t}"} for t in range(n_tribes)]
+        self.tribe_events: Dict[int, List[int]] = {}
+        for t, tribe in enumerate(self.tribes):
+            ids = [self._new_activity(900_000 + t * events_per_tribe + e, tribe=tribe) for e in range(events_per_tribe)]
+            self.tribe_events[tribe["id"]] = ids
+        self.cache = self._build_cache(n_cache)
+
+    def _fmt(self, offset_hours: float) -> str:
+        return datetime.datetime.fromtimestamp(self.base_ts + offset_hours * 3600).strftime("%Y-%m-%d %H:%M:%S")
+
+    def _new_activity(self, act_id: int, tribe: Optional[Dict[str, Any]] = None) -> int:
+        rng = self.rng
+        start_h = rng.uniform(-240, 720)
+        capacity = rng.choice([30, 50, 100, 200, 500, 1000, 3000])
+        self.details[act_id] = {
+            "id": act_id,
+            "name": f"{rng.choice(self._TOPICS)}{rng.choice(self._KINDS)}（第{rng.randint(1, 12)}期）",
+            "description": "\n".join(f"{rng.choice(self._TOPICS)}相关内容介绍，欢迎同学踊跃报名。" for _ in range(rng.randint(1, 6))),
+            "joinStartTime": self._fmt(start_h - rng.uniform(24, 240)),
+            "joinEndTime": self._fmt(start_h - rng.uniform(1, 24)),
+            "startTime": self._fmt(start_h),
+            "endTime": self._fmt(start_h + rng.uniform(1, 6)),
+            "allowUserCount": capacity,
+            "joinUserCount": rng.randint(0, capacity),
+            "signInUserCount": 0,
+            "credit": rng.choice([0, 0.1, 0.2, 0.5, 1]),
+            "puAmount": rng.choice([0, 5, 10, 20]),
+            "tags": [{"id": 1, "name": rng.choice(self._KINDS)}],
+            "allowTribe": [dict(tribe)] if tribe else [],
+            "allowCollege": [{"id": c} for c in rng.sample(self.colleges, rng.randint(1, 3))] if rng.random() < 0.3 else [],
+            "allowYears": [{"id": y} for y in rng.sample(self.years, rng.randint(1, 3))] if rng.random() < 0.3 else [],
+            "attachName": "http://example.com/a.pdf" if rng.random() < 0.2 else None,
+            "attachTitle": "活动须知.pdf" if rng.random() < 0.2 else None,
+            "status": 1,
+            "statusName": rng.choice(self._STATUS),
+            "creatorName": f"{rng.choice(self._TOPICS)}中心",
         }
+        return act_id
+
+    def _list_item(self, act_id: int) -> Dict[str, Any]:
+        d = self.details[act_id]
+        return {k: d[k] for k in ("id", "name", "statusName", "startTime", "endTime", "joinUserCount", "allowUserCount")}
+
+    def _build_cache(self, n_cache: int) -> Dict[str, Any]:
+        public = {}
+        ids = self.public_ids + [20_000_000 + i for i in range(max(0, n_cache - len(self.public_ids)))]
+        for act_id in ids[:n_cache]:
+            if act_id not in self.details:
+                self._new_activity(act_id)
+            record = {f: self.details[act_id].get(f) for f in REQUIRED_FIELDS}
+            joined = int(record["joinUserCount"] or 0)
+            record["_state"] = {"last_joined": max(0, joined - self.rng.randint(0, 120)), "detail_count": self.rng.randint(0, 4),
+                                "acc_increase": self.rng.randint(0, 60), "is_large": True,
+                                "update_time": self._fmt(0)}
+            public[str(act_id)] = record
+        tribe = {}
+        for ids in self.tribe_events.values():
+            for act_id in ids[:2]:
+                record = {f: self.details[act_id].get(f) for f in REQUIRED_FIELDS}
+                record["_state"] = {"last_joined": 0, "update_time": self._fmt(0)}
+                tribe[str(act_id)] = record
+        return {"last_run_time": self._fmt(0), "tribe_last_run": self._fmt(0), "public_last_run": self._fmt(0),
+                "tribe": tribe, "public": public}
+
+    def list_payload(self, status: Optional[int] = None) -> Dict[str, Any]:
+        ids = self.public_ids + [i for ids in self.tribe_events.values() for i in ids]
+        if status == 3:
+            ids = [i for i in ids if self.details[i]["statusName"] == "已结束"]
+        return {"code": 0, "data": {"list": [self._list_item(i) for i in ids]}}
+
+    def detail_payload(self, act_id: Any) -> Dict[str, Any]:
+        detail = self.details.get(int(act_id))
+        return {"code": 0, "data": {"baseInfo": dict(detail)}} if detail else {"code": 404, "data": None}
+
+    @staticmethod
+    def _page(items: List[Any], page: Optional[int], limit: Optional[int]) -> List[Any]:
+        if not limit:
+            return items
+        start = (max(page or 1, 1) - 1) * limit
+        return items[start:start + limit]
+
+    def tribe_list_payload(self, page: Optional[int] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        return {"code": 0, "data": {"list": [dict(t) for t in self._page(self.tribes, page, limit)]}}
+
+    def event_list_payload(self, tribe_id: Any, page: Optional[int] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        ids = self._page(self.tribe_events.get(tribe_id, []), page, limit)
+        return {"code": 0, "data": {"list": [self._list_item(i) for i in ids]}}
+
+    def post(self, url: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """与 safe_post_request 同签名的离线响应"""
+        if url == URL_ACTIVITY_LIST:
+            return self.list_payload(payload.get("status"))
+        if url == URL_ACTIVITY_INFO:
+            return self.detail_payload(payload.get("id"))
+        if url == URL_MY_TRIBE:
+            return self.tribe_list_payload(payload.get("page"), payload.get("limit"))
+        if url == URL_TRIBE_EVENT:
+            return self.event_list_payload(payload.get("tribeID"), payload.get("page"), payload.get("limit"))
+        return None
+@contextlib.contextmanager
+def _patched_globals(**overrides):
+    """[内部辅助] 临时替换模块级配置/函数 (离线基准与模拟使用)，退出时恢复"""
+    module_globals = globals()
+    saved = {k: module_globals[k] for k in overrides}
+    module_globals.update(overrides)
+    try:
+        yield
+    finally:
+        module_globals.update(saved)
+def _bench_stage(name: str, size: int, func, results: List[Dict[str, Any]]) -> Any:
+    """[内部辅助] 先计时执行一次，再在 tracemalloc 下执行一次取峰值内存"""
+    import tracemalloc
+
+    result, cost_ms = _bench_timer(func)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    results.append({"stage": name, "size": size, "ms": cost_ms, "peak_kb": peak / 1024})
+    return result
+def bench_pipeline(args: argparse.Namespace):
+    """
+    流水线规模基准：对每个规模 N 生成 N 个公共活动、N/50 个社团、10N 条缓存，
+    分阶段统计耗时与峰值内存 (详情/社团接口由 SyntheticDataset 离线响应)
+    """
+    import tempfile
+
+    sizes = [int(x) for x in str(args.sizes).split(",") if x.strip()]
+    results: List[Dict[str, Any]] = []
+
+    for size in sizes:
+        data = SyntheticDataset(seed=args.seed, n_public=size, n_tribes=max(1, size // 50), n_cache=size * 10)
+        list_items = data.list_payload()["data"]["list"]
+        ended_items = data.list_payload(status=3)["data"]["list"]
+        tmp_dir = tempfile.mkdtemp(prefix="pu_bench_")
+
+        with _patched_globals(safe_post_request=data.post, log=lambda message: None,
+                              FILTER_KEYWORDS=data.keywords, DATA_FILE=os.path.join(tmp_dir, "cache.json")):
+            effective = _bench_stage("filter_effective_activities", size,
+                                     lambda: filter_effective_activities(list_items, ended_items), results)
+            effective = _bench_stage("filter_by_keywords", size, lambda: filter_by_keywords(effective), results)
+            public = _bench_stage("fetch_and_clean_data (offline)", size,
+                                  lambda: clean_activity_descriptions(fetch_and_clean_data(effective, filter_tribe_limit=True)), results)
+            tribe_events = _bench_stage("fetch_valid_tribe_activities (offline)", size,
+                                        lambda: fetch_valid_tribe_activities(data.tribes), results)
+            tribe = fetch_and_clean_data(tribe_events, filter_tribe_limit=False)
+
+            _bench_stage("process_public_activities", size,
+                         lambda: process_public_activities(public, data.cache["public"]), results)
+            _bench_stage("process_tribe_activities", size,
+                         lambda: process_tribe_activities(tribe, data.cache["tribe"]), results)
+            _bench_stage("format_activity_markdown", size,
+                         lambda: [format_activity_markdown(a, show_detail=d) for a in public for d in (True, False)], results)
+            _bench_stage(f"save_data (cache={len(data.cache['public'])})", size, lambda: save_data(data.cache), results)
+            _bench_stage(f"load_data (cache={len(data.cache['public'])})", size, load_data, results)
+
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+    log(f"🏁 流水线规模基准 (seed={args.seed})")
+    print(f"{'阶段':<40}{'规模':>8}{'耗时(ms)':>12}{'峰值内存(KB)':>16}")
+    for r in results:
+        print(f"{r['stage']:<40}{r['size']:>8}{r['ms']:>12.1f}{r['peak_kb']:>16.1f}")
+
+
+def bench_dedup(args: argparse.Namespace):
+    """相似活动索引基准：LSH 分桶查询 vs 与全部已有签名逐一比较"""
+    sizes = [int(x) for x in str(args.sizes).split(",") if x.strip()]
+    data = SyntheticDataset(seed=args.seed, n_public=max(sizes), n_tribes=1)
+    activities = [data.details[i] for i in data.public_ids]
+    index = NearDuplicateIndex({})
+    probes = activities[:100]
+    probe_signatures = [index.signature(index._normalize(a)) for a in probes]
+
+    log(f"🏁 相似活动索引基准 (seed={args.seed}, 查询 {len(probes)} 个)")
+    print(f"{'索引规模':>10}{'建索引(ms/个)':>16}{'LSH查询(ms/个)':>18}{'线性扫描(ms/个)':>18}{'相似簇':>8}")
+    for size in sizes:
+        batch = activities[len(index):size]
+        _, build_ms = _bench_timer(lambda: [index.add(a) for a in batch])
+
+        def lsh_lookup():
+            for sig in probe_signatures:
+                candidates = {c for key in index._band_keys(sig) for c in index.buckets.get(key, ())}
+                [index.similarity(sig, index.signatures[c]) for c in candidates]
+
+        def linear_lookup():
+            for sig in probe_signatures:
+                [index.similarity(sig, other) for other in index.signatures.values()]
+
+        _, lsh_ms = _bench_timer(lsh_lookup)
+        _, linear_ms = _bench_timer(linear_lookup)
+        print(f"{size:>10}{build_ms / max(len(batch), 1):>16.3f}{lsh_ms / len(probes):>18.3f}"
+              f"{linear_ms / len(probes):>18.3f}{len(index.clusters):>8}")
+
+
+def bench_json(args: argparse.Namespace):
+    """
+    JSON 编解码基准：对规模 N 的历史缓存 (10N 条) 与全局列表响应 (约 N 条)，
+    比较标准库 / orjson (若已安装) / 二进制快照的序列化与解析耗时 (3 次取最快) 及体积
+    """
+    sizes = [int(x) for x in str(args.sizes).split(",") if x.strip()]
+    codecs = [
+        ("stdlib (indent)", lambda o: json.dumps(o, ensure_ascii=False, indent=2).encode('utf-8'),
+         lambda b: json.loads(b.decode('utf-8'))),
+        ("stdlib (compact)", lambda o: json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode('utf-8'),
+         lambda b: json.loads(b.decode('utf-8'))),
+    ]
+    if orjson is not None:
+        codecs += [
+            ("orjson (indent)", lambda o: orjson.dumps(o, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2), orjson.loads),
+            ("orjson (compact)", lambda o: orjson.dumps(o, option=orjson.OPT_NON_STR_KEYS), orjson.loads),
+        ]
+    else:
+        log("ℹ️ 未安装 orjson，仅比较标准库与二进制快照 (pip install orjson)")
+    snapshot = ("snapshot (marshal)", lambda o: encode_cache(o, "snapshot"), decode_cache)
+
+    log(f"🏁 JSON 编解码基准 (seed={args.seed})")
+    print(f"{'数据':<22}{'编解码':<22}{'体积(KB)':>12}{'序列化(ms)':>14}{'解析(ms)':>12}")
+    for size in sizes:
+        data = SyntheticDataset(seed=args.seed, n_public=size, n_tribes=max(1, size // 50), n_cache=size * 10)
+        list_payload = data.list_payload()
+        samples = [
+            (f"缓存 ({len(data.cache['public'])} 条)", data.cache, codecs + [snapshot]),
+            (f"列表响应 ({len(list_payload['data']['list'])} 条)", list_payload, codecs),
+        ]
+        for label, obj, variants in samples:
+            for name, dumps, loads in variants:
+                # 各取 3 次中的最快值，减少 GC 等抖动
+                raw, dump_ms = min((_bench_timer(dumps, obj) for _ in range(3)), key=lambda r: r[1])
+                parsed, load_ms = min((_bench_timer(loads, raw) for _ in range(3)), key=lambda r: r[1])
+                assert parsed == obj, f"{name} 往返结果不一致"
+                print(f"{label:<22}{name:<22}{len(raw) / 1024:>12.1f}{dump_ms:>14.1f}{load_ms:>12.1f}")
+
+
+def bench_unified(args: argparse.Namespace):
+    """
+    合并流水线基准：同一数据集上分别运行社团 + 公共两条流水线与 stream_unified_activities，
+    比较详情请求次数，并核对两者产出的公共活动一致 (半数社团活动设为无社团限制，同时出现在全局列表中)。
+    第二轮带缓存运行，社团全部走游标跳过，核对沿用缓存记录时公共活动仍然一致。
+    """
+    sizes = [int(x) for x in str(args.sizes).split(",") if x.strip()]
+
+    log(f"🏁 合并流水线基准 (seed={args.seed})")
+    print(f"{'规模':>8}{'分开请求详情':>16}{'合并请求详情':>16}{'公共活动':>10}{'一致':>6}{'带缓存一致':>12}")
+    for size in sizes:
+        data = SyntheticDataset(seed=args.seed, n_public=size, n_tribes=max(1, size // 50))
+        for ids in data.tribe_events.values():
+            for act_id in ids[::2]:
+                data.details[act_id]["allowTribe"] = []
+        info_requests = [0]
+
+        def post(url, payload):
+            if url == URL_ACTIVITY_INFO:
+                info_requests[0] += 1
+            return data.post(url, payload)
+
+        with _patched_globals(safe_post_request=post, log=lambda message: None, FILTER_KEYWORDS=[]):
+            expected = {str(a["id"]): a for a in stream_public_activities()}
+            list(stream_tribe_activities())
+            separate_requests, info_requests[0] = info_requests[0], 0
+
+            unified = {str(a["id"]): a for kind, a in stream_unified_activities() if kind == "public"}
+            unified_requests = info_requests[0]
+            assert unified == expected, "合并流水线的公共活动与单独运行不一致"
+
+            # 带缓存：第一轮记录游标，第二轮社团首页未变化，全部沿用缓存记录
+            cache = {"tribe": {}, "public": {}}
+            for kind, item in stream_unified_activities(cache_data=cache):
+                cache[kind][str(item["id"])] = item
+            carried = {str(a["id"]) for kind, a in stream_unified_activities(cache_data=cache) if kind == "public"}
+            assert carried == set(expected), "沿用缓存记录时公共活动与单独运行不一致"
+
+        print(f"{size:>8}{separate_requests:>16}{unified_requests:>16}{len(expected):>10}{'✅':>6}{'✅':>12}")
+
+
+# 基准套件注册表: 名称 -> 执行函数
+BENCH_SUITES = {
+    "subscriptions": bench_subscriptions,
+    "pipeline": bench_pipeline,
+    "dedup": bench_dedup,
+    "json": bench_json,
+    "unified": bench_unified,
+}
+
+# ------------------------------------------------------------------------------
+# 策略模拟 (离线回放报名人数历史，比较不同限流阈值)
+# ------------------------------------------------------------------------------
+# 回放数据来自缓存与归档中的 _state.history；虚拟时钟按 --interval 重新采样 (只在运行窗口内"运行")。
+# 公共活动的限流决策与 iter_process_public_activities 共用 _public_rate_limit，保证与线上一致；
+# 结果按 (活动, 是否大型的判定结果, 阈值) 记忆化，数千组配置也只需几秒。
+def load_join_series(include_archive: bool = True) -> List[Dict[str, Any]]:
+    """
+    收集可回放的报名人数序列
+    :return: [{"id", "group", "record", "points": [[时间戳, 人数], ...]}]，缓存优先于归档
+    """
+    series: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def add(group: str, act_id: str, record: Dict[str, Any]):
+        points = (record.get("_state") or {}).get("history") or []
+        if points and (group, act_id) not in series:
+            series[(group, act_id)] = {"id": act_id, "group": group, "record": record, "points": points}
+
+    cache_data = load_data()
+    for group in ("tribe", "public"):
+        for act_id, record in cache_data.get(group, {}).items():
+            add(group, act_id, record)
+    if include_archive:
+        for item in iter_archive():
+            add(item.get("group", "public"), str(item.get("id")), item.get("record") or {})
+    return list(series.values())
+def synthetic_join_series(n_public: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """基于 SyntheticDataset 生成报名增长曲线 (报名期内分批涌入，越临近截止越密集)，用于没有真实历史时评估"""
+    data = SyntheticDataset(seed=seed, n_public=n_public, n_tribes=max(1, n_public // 50))
+    rng = random.Random(seed)
+    series = []
+    for act_id, detail in data.details.items():
+        join_start = _to_timestamp(detail["joinStartTime"])
+        join_end = _to_timestamp(detail["joinEndTime"])
+        final = int(detail["joinUserCount"])
+        if final <= 0 or join_end <= join_start:
+            continue
+        steps = sorted(join_start + (join_end - join_start) * rng.random() ** 0.5 for _ in range(rng.randint(1, 40)))
+        cuts = sorted(rng.randint(1, final) for _ in steps[:-1]) + [final]
+        points = []
+        for ts, joined in zip(steps, cuts):
+            if not points or points[-1][1] != joined:
+                points.append([int(ts), joined])
+        record = {f: detail.get(f) for f in REQUIRED_FIELDS}
+        group = "tribe" if detail.get("allowTribe") else "public"
+        series.append({"id": str(act_id), "group": group, "record": record, "points": points})
+    return series
+def _observations(points: List[List[int]], interval_sec: float) -> List[Tuple[float, int, float]]:
+    """
+    [内部辅助] 虚拟时钟采样
+    :param interval_sec: 0 表示每个历史点就是一次观测；否则每隔 interval_sec 在运行窗口内观测一次
+    :return: [(观测时间, 人数, 本次观测到的变化最早发生时间)]
+    """
+    if not interval_sec:
+        return [(float(ts), int(joined), float(ts)) for ts, joined in points]
+
+    observations = []
+    i = 0
+    tick = float(points[0][0])
+    joined = 0
+    changed_at = None
+    while i < len(points):
+        # 收集 tick 之前发生的变化
+        while i < len(points) and points[i][0] <= tick:
+            if changed_at is None:
+                changed_at = float(points[i][0])
+            joined = int(points[i][1])
+            i += 1
+        if changed_at is not None and _is_in_run_window(datetime.datetime.fromtimestamp(tick)):
+            observations.append((tick, joined, changed_at))
+            changed_at = None
+        tick += interval_sec
+    return observations
+def _replay_activity(observations: List[Tuple[float, int, float]], large_flags: List[bool], max_detail: int, batch: int,
+                     is_tribe: bool) -> Tuple[int, int, int, float, int, float, int]:
+    """
+    [内部辅助] 回放单个活动
+    :return: (消息数, 详细数, 简略数, 延迟合计秒, 已通知变化数, 最大延迟秒, 未通知变化数)
+    """
+    messages = detail = brief = notified = 0
+    latency_sum = latency_max = 0.0
+    detail_count = acc_increase = 0
+    last_joined = 0
+    pending: List[float] = []
+
+    for index, (tick, joined, changed_at) in enumerate(observations):
+        delta = joined - last_joined
+        last_joined = joined
+        if is_tribe:
+            # 社团活动不限流：新活动或人数增加即详细通知
+            should_notify, show_detail = index == 0 or delta > 0, True
+        else:
+            should_notify, show_detail, _, detail_count, acc_increase = _public_rate_limit(
+                delta, large_flags[index], detail_count, acc_increase, max_detail, batch)
+        if delta > 0:
+            pending.append(changed_at)
+        if not should_notify:
+            continue
+
+        messages += 1
+        if show_detail:
+            detail += 1
+        else:
+            brief += 1
+        for since in pending:
+            latency = tick - since
+            latency_sum += latency
+            latency_max = max(latency_max, latency)
+        notified += len(pending)
+        pending = []
+    return messages, detail, brief, latency_sum, notified, latency_max, len(pending)
+def simulate_policies(series: List[Dict[str, Any]], configs: List[Dict[str, Any]], interval_sec: float = 0) -> List[Dict[str, Any]]:
+    """
+    对每组阈值配置回放全部序列并汇总
+    配置键: max_detail / batch / capacity / duration / force_large
+    """
+    prepared = []
+    for item in series:
+        observations = _observations(item["points"], interval_sec)
+        if not observations:
+            continue
+        record = item["record"]
+        try:
+            capacity = int(record.get("allowUserCount") or 0)
+        except (TypeError, ValueError):
+            capacity = 0
+        days = max(_get_days_diff(record.get("startTime"), record.get("endTime")),
+                   _get_days_diff(record.get("joinStartTime"), record.get("joinEndTime")))
+        prepared.append({
+            "tribe": item["group"] == "tribe",
+            "observations": observations,
+            "joined_sorted": sorted({o[1] for o in observations}),
+            "capacity": capacity,
+            "days": days,
+        })
+
+    # 每组 (人数门槛, 天数门槛, 是否全大型) 先算出各活动的"大型判定类别"：
+    # "tribe" 社团 / "all" 全程大型 / "none" 全程普通 / 整数 = 门槛在人数序列中的位置。
+    # 类别向量相同的规则 (如全大型模式下的所有门槛组合) 合并计算，每组阈值只汇总一次。
+    by_signature: Dict[Tuple, List[Dict[str, Any]]] = {}
+    signature_of: Dict[Tuple, Tuple] = {}
+    for config in configs:
+        rule = (config["capacity"], config["duration"], config["force_large"])
+        if rule not in signature_of:
+            classes = []
+            for act in prepared:
+                if act["tribe"]:
+                    classes.append("tribe")
+                elif config["force_large"] or act["capacity"] > config["capacity"] or act["days"] > config["duration"]:
+                    classes.append("all")
+                else:
+                    cut = bisect.bisect_right(act["joined_sorted"], config["capacity"])
+                    classes.append("none" if cut == len(act["joined_sorted"]) else cut)
+            signature_of[rule] = tuple(classes)
+        by_signature.setdefault(signature_of[rule], []).append(config)
+
+    shared: Dict[Tuple, Tuple] = {}                 # 与阈值无关的类别 (tribe / none)
+    per_threshold: Dict[Tuple, Dict[Tuple, Tuple]] = {}
+    results = []
+    for classes, group in by_signature.items():
+        totals_by_threshold: Dict[Tuple, Dict[str, Any]] = {}
+        for config in group:
+            threshold = (config["max_detail"], config["batch"])
+            if threshold not in totals_by_threshold:
+                memo = per_threshold.setdefault(threshold, {})
+                rows = []
+                for index, cls in enumerate(classes):
+                    key = (index, cls)
+                    cache = shared if cls in ("tribe", "none") else memo
+                    result = cache.get(key)
+                    if result is None:
+                        act = prepared[index]
+                        observations = act["observations"]
+                        if cls == "all":
+                            large = [True] * len(observations)
+                        elif cls in ("tribe", "none"):
+                            large = [False] * len(observations)
+                        else:
+                            first_large = act["joined_sorted"][cls]
+                            large = [o[1] >= first_large for o in observations]
+                        result = _replay_activity(observations, large, threshold[0], threshold[1], act["tribe"])
+                        cache[key] = result
+                    rows.append(result)
+
+                columns = list(zip(*rows)) or [()] * 7
+                notified = sum(columns[4])
+                totals_by_threshold[threshold] = {
+                    "messages": sum(columns[0]), "detail": sum(columns[1]), "brief": sum(columns[2]),
+                    "latency_avg_min": sum(columns[3]) / notified / 60 if notified else 0.0,
+                    "latency_max_min": max(columns[5], default=0.0) / 60, "pending": sum(columns[6]),
+                }
+            results.append(dict(config, **totals_by_threshold[threshold]))
+    return results
+def verify_with_processors(series: List[Dict[str, Any]], config: Dict[str, Any]) -> Tuple[int, int, int]:
+    """
+    用真实的 iter_process_*_activities 逐点回放 (慢，仅用于校验模拟结果)
+    :return: (消息数, 详细数, 简略数)
+    """
+    messages = detail = brief = 0
+    overrides = {
+        "MAX_LARGE_DETAIL_COUNT": config["max_detail"],
+        "LARGE_NOTIFY_BATCH": config["batch"],
+        "LARGE_ACT_CAPACITY_LIMIT": config["capacity"],
+        "LARGE_ACT_DURATION_DAYS": config["duration"],
+        "LARGE_ACT_FORCE_ALL": config["force_large"],
+        "log": lambda message: None,
+    }
+    with _patched_globals(**overrides):
+        for item in series:
+            base = {k: v for k, v in item["record"].items() if k != "_state"}
+            base["id"] = item["id"]
+            processor = iter_process_tribe_activities if item["group"] == "tribe" else iter_process_public_activities
+            old_group: Dict[str, Any] = {}
+            for _, joined, _ in _observations(item["points"], 0):
+                new_group: Dict[str, Any] = {}
+                act = dict(base, joinUserCount=joined)
+                for entry in processor([act], old_group, new_group, emit_events=False):
+                    messages += 1
+                    if entry["detail"]:
+                        detail += 1
+                    else:
+                        brief += 1
+                old_group = new_group
+    return messages, detail, brief
+def _parse_grid(value: str, cast=int) -> List[Any]:
+    return [cast(x) for x in str(value).split(",") if x.strip()]
+def run_simulation(args: argparse.Namespace):
+    """simulate 子命令：枚举阈值组合，离线回放并输出对比表"""
+    if args.synthetic:
+        series = synthetic_join_series(args.synthetic, args.seed)
+        source = f"合成数据 (seed={args.seed})"
+    else:
+        series = load_join_series(include_archive=not args.no_archive)
+        source = "缓存" + ("" if args.no_archive else " + 归档")
+    if not series:
+        log("⚠️ 没有可回放的报名人数历史 (_state.history)，可先用 --synthetic N 试跑")
+        return
 
-        save_data(data_to_save)
-        print("\n✅ 数据状态已保存")
+    configs = [{"max_detail": d, "batch": b, "capacity": c, "duration": t, "force_large": bool(f)}
+               for d in _parse_grid(args.detail_counts) for b in _parse_grid(args.batches)
+               for c in _parse_grid(args.capacity_limits) for t in _parse_grid(args.duration_limits, float)
+               for f in _parse_grid(args.force_large)]
+    current = {"max_detail": MAX_LARGE_DETAIL_COUNT, "batch": LARGE_NOTIFY_BATCH, "capacity": LARGE_ACT_CAPACITY_LIMIT,
+               "duration": float(LARGE_ACT_DURATION_DAYS), "force_large": LARGE_ACT_FORCE_ALL}
+    if current not in configs:
+        configs.append(current)
+
+    start = time.perf_counter()
+    results = simulate_policies(series, configs, args.interval * 60)
+    cost = time.perf_counter() - start
+    points = sum(len(item["points"]) for item in series)
+    log(f"🧪 策略模拟: {source} {len(series)} 个活动 / {points} 个历史点 | {len(configs)} 组配置 | 耗时 {cost:.2f}s")
+
+    if args.verify:
+        baseline = next(r for r in results if {k: r[k] for k in current} == current)
+        actual = verify_with_processors(series, current)
+        expected = (baseline["messages"], baseline["detail"], baseline["brief"])
+        log(f"   {'✅' if actual == expected else '❌'} 处理器校验 (当前配置): 处理器 {actual} / 模拟 {expected}")
+
+    sort_keys = {
+        "messages": lambda r: (r["messages"], r["latency_avg_min"]),
+        "latency": lambda r: (r["latency_avg_min"], r["messages"]),
+    }
+    results.sort(key=sort_keys[args.sort])
+    if args.json:
+        for r in results:
+            sys.stdout.write(json.dumps(r, ensure_ascii=False) + "\n")
+        return
 
-        # ---------------- Step 6: 批量发送消息 ----------------
-        # 只有当有实际变动消息时，才调用发送接口
-        if all_messages:
-            # 调用刚才写好的 POST 发送函数
-            send_messages(all_messages)
+    print(f"{'详细上限':>8}{'积攒阈值':>8}{'人数门槛':>8}{'天数门槛':>8}{'全大型':>6}"
+          f"{'消息数':>8}{'详细':>8}{'简略':>8}{'平均延迟(分)':>14}{'最大延迟(分)':>14}{'未通知':>8}")
+    for r in results[:args.top] + [r for r in results[args.top:] if {k: r[k] for k in current} == current]:
+        mark = " ← 当前" if {k: r[k] for k in current} == current else ""
+        print(f"{r['max_detail']:>8}{r['batch']:>8}{r['capacity']:>8}{r['duration']:>8g}{'是' if r['force_large'] else '否':>6}"
+              f"{r['messages']:>8}{r['detail']:>8}{r['brief']:>8}{r['latency_avg_min']:>14.1f}{r['latency_max_min']:>14.1f}"
+              f"{r['pending']:>8}{mark}")
 
-            # (本地调试用，可以看到发了什么，实际运行在服务器上看log即可)
-            print("-" * 30)
-            print(f"共推送 {len(all_messages)} 条内容")
+def run_monitor():
+    """
+    监控入口：先取得分支租约 (单机文件后端总能取得)，执行监控流程，结束后释放租约
+    多节点部署时未取得租约的分支由其他节点负责，本节点不请求也不推送。
+    """
+    backend = get_backend()
+    try:
+        owned = acquire_branch_leases(backend)
+    except Exception as e:
+        log(f"❌ 协同后端不可用，本次跳过: {e}")
+        return
+    if not any(owned.values()):
+        print("💤 各分支均由其他节点执行，脚本结束。")
+        return
+
+    try:
+        run_monitor_branches(owned)
+    except LeaseLostError as e:
+        log(f"❌ {e}，本次不保存也不推送")
+    finally:
+        # 中途出错时丢弃未提交的变更事件
+        close_event_log()
+        release_branch_leases(backend, owned)
+def run_monitor_branches(owned: Dict[str, bool]):
+    """执行一次完整的监控流程：读缓存 -> 调度检查 -> 流式抓取与处理 -> 保存 -> 推送"""
+    # ---------------- Step 1: 读取本地缓存 ----------------
+    full_cache_data = load_data()
+
+    old_tribe_data = full_cache_data.get("tribe", {})
+    old_public_data = full_cache_data.get("public", {})
+
+    # ---------------- Step 2: 调度检查 (决定跑什么) ----------------
+    do_run_tribe, do_run_public = check_run_conditions(full_cache_data)
+    # 只执行本节点持有租约的分支，只写回这些分支的缓存分组
+    do_run_tribe = do_run_tribe and owned["tribe"]
+    do_run_public = do_run_public and owned["public"]
+    sections = [name for name in ("tribe", "public") if owned[name]] + ["meta"]
+
+    # 如果全都不需要跑，直接退出，极致省流
+    # (摘要模式下若积攒的消息已到期，仍需推送一次)
+    if not do_run_tribe and not do_run_public:
+        digest_state = full_cache_data.get("digest")
+        if DIGEST_ENABLED and digest_state and should_flush_digest(digest_state):
+            messages = flush_digest(digest_state)
+            if save_data(full_cache_data, ["meta"]):
+                send_messages(messages)
+        print("💤 所有任务均未达到执行间隔，脚本结束。")
+        return
+
+    # ---------------- Step 3: 准备消息出口 ----------------
+    # 数据按需流式请求：只请求需要执行的部分，减少封号风险；
+    # 每个活动详情返回后立即处理并把消息放入出口 (这是要发给客户端的干货)，保存数据后统一推送
+    outbox = MessageOutbox(full_cache_data)
+
+    # 准备用于保存的数据 (默认为旧数据)
+    final_tribe_data = old_tribe_data
+    final_public_data = old_public_data
+
+    # 获取当前时间
+    now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # 多用户订阅：公共活动详情不按本人画像过滤，拿到后先分发给订阅者再做本人判定
+    sub_index = None
+    sub_old_state: Dict[str, Dict[str, Any]] = {}
+    sub_new_state: Dict[str, Dict[str, Any]] = {}
+    sub_outboxes: Dict[str, List[str]] = {}
+    if SUBSCRIPTION_ENABLED and do_run_public:
+        sub_index = SubscriptionIndex(load_subscribers())
+        sub_old_state = load_subscription_state()
+        log(f"👥 多用户订阅已开启: {len(sub_index)} 个订阅者")
+    filter_profile = sub_index is None
+
+    # 本地活动索引：记录本次抓取到的全部活动
+    store = open_activity_store() if ACTIVITY_STORE_ENABLED else None
+    # 变更事件日志：处理器在判定过程中暂存，状态保存成功后才写入
+    open_event_log()
+
+    # 相似活动合并：公共活动消息在分支结束后按相似簇合并推送
+    dedup = NearDuplicateIndex(full_cache_data.setdefault("dedup", {})) if DEDUP_ENABLED and do_run_public else None
+    held: Dict[str, List[Tuple[Dict[str, Any], Dict[str, Any]]]] = {}
+
+    # 长时间运行时定期续约分支租约 (每 1/3 租约时长)，续约失败抛出 LeaseLostError 放弃本次运行
+    backend = get_backend()
+    last_renew = time.monotonic()
+
+    def checkpoint(force: bool = False):
+        nonlocal last_renew
+        if force or time.monotonic() - last_renew >= COORD_LEASE_TTL_SEC / 3:
+            renew_branch_leases(backend, owned)
+            last_renew = time.monotonic()
+
+    def record(act: Dict[str, Any], source: str):
+        nonlocal store
+        checkpoint()
+        if store is None:
+            return
+        try:
+            store_activity(store, act, source)
+        except sqlite3.Error as e:
+            # 索引只是旁路数据：写入失败 (库被锁/损坏) 不影响监控，本次运行不再写入
+            log(f"⚠️ 本地活动索引写入失败，本次运行停用: {e}")
+            close_activity_store(store, commit=False)
+            store = None
+
+    def handle_tribe(act: Dict[str, Any]):
+        """社团活动：写入索引 -> 社团处理器"""
+        record(act, "tribe")
+        for entry in iter_process_tribe_activities([act], old_tribe_data, final_tribe_data):
+            outbox.put(entry)
+
+    def handle_public(act: Dict[str, Any]):
+        """公共活动：写入索引 -> (订阅分发) -> 本人画像判定 -> 公共处理器"""
+        record(act, "public")
+        if sub_index is not None:
+            fan_out_subscriptions(sub_index, act, sub_old_state, sub_new_state, sub_outboxes)
+            college_ids = act.pop("_allowCollegeIds", [])
+            year_ids = act.pop("_allowYearIds", [])
+            if check_profile_restrictions(college_ids, year_ids, ALLOW_YEARS, TARGET_COLLEGE_ID):
+                return
+        canonical = dedup.add(act) if dedup is not None else None
+        for entry in iter_process_public_activities([act], old_public_data, final_public_data):
+            if dedup is None:
+                outbox.put(entry)
+            else:
+                # 同一相似簇的消息先暂存，分支结束后合并为一条
+                held.setdefault(canonical, []).append((entry, act))
+
+    # ---------------- Step 4: 执行业务逻辑 ----------------
+
+    # === 合并运行: 两个分支同时到期，共用一个去重后的详情队列 ===
+    unified = do_run_tribe and do_run_public and UNIFIED_RUN
+    if unified:
+        print(f"\n⚡ 合并分析社团与公共数据变动...")
+        final_tribe_data = {}
+        final_public_data = {}
+        for branch, act in stream_unified_activities(filter_profile=filter_profile, cache_data=full_cache_data):
+            if branch == "tribe":
+                handle_tribe(act)
+            else:
+                handle_public(act)
+
+        # 更新运行时间
+        full_cache_data["tribe_last_run"] = now_str
+        full_cache_data["public_last_run"] = now_str
+
+    # === A. 处理社团活动 ===
+    if do_run_tribe and not unified:
+        print(f"\n⚡ 分析社团数据变动...")
+        # 这里的 process 函数只会产出 mkdown 数据，不含 log
+        final_tribe_data = {}
+        for act in stream_tribe_activities(full_cache_data):
+            handle_tribe(act)
+
+        # 更新运行时间
+        full_cache_data["tribe_last_run"] = now_str
+
+    # === B. 处理公共活动 ===
+    if do_run_public and not unified:
+        print(f"\n⚡ 分析公共数据变动...")
+        final_public_data = {}
+        for act in stream_public_activities(filter_profile=filter_profile):
+            handle_public(act)
+
+        # 更新运行时间
+        full_cache_data["public_last_run"] = now_str
+
+    if store is not None:
+        close_activity_store(store)
+
+    if dedup is not None:
+        merged = 0
+        for canonical, items in held.items():
+            outbox.put(merge_duplicate_entries(items, dedup.cluster_size(canonical)))
+            merged += len(items) - 1
+        if merged:
+            log(f"🧬 相似活动合并: 减少 {merged} 条消息")
+        # 索引只保留本次仍然有效的公共活动 (一条都没取到时多半是网络问题，不清理)
+        if final_public_data:
+            dedup.prune(final_public_data.keys())
+
+    # 剩余待推送的内容 (摘要模式下可能仍在缓冲区)
+    log(f"📊 本次共产生 {outbox.total} 条消息")
+    all_messages = outbox.close()
+
+    # ---------------- Step 5: 归档并保存数据 ----------------
+    # 消失/结束的活动移入归档，主缓存只保留本次仍然有效的活动
+    # (归档在状态保存成功后才写入，保存失败或租约丢失时下次运行会重新归档，避免重复记录)
+    archived = []
+    if ARCHIVE_ENABLED:
+        if do_run_tribe:
+            archived += collect_archive_records(old_tribe_data, final_tribe_data, "tribe")
+        if do_run_public:
+            archived += collect_archive_records(old_public_data, final_public_data, "public")
+
+    # 先保存状态，防止发送消息出错导致数据回滚
+    data_to_save = {
+        "tribe_last_run": full_cache_data.get("tribe_last_run", ""),
+        "public_last_run": full_cache_data.get("public_last_run", ""),
+        "tribe": final_tribe_data,
+        "public": final_public_data
+    }
+    for key in ("digest", "tribe_cursors", "tribe_membership", "dedup"):
+        if key in full_cache_data:
+            data_to_save[key] = full_cache_data[key]
+
+    # 写回前确认租约仍在，避免覆盖已接管该分支的节点
+    checkpoint(force=True)
+    saved = save_data(data_to_save, sections)
+    if saved and sub_index is not None:
+        saved = save_subscription_state(sub_new_state)
+    if not saved:
+        # 状态没有保存下来：本次不推送，下次运行会重新产生这些消息，避免重复推送
+        print("\n❌ 数据状态保存失败，本次不推送")
+        return
+    commit_event_log()
+    archive_records(archived)
+    print("\n✅ 数据状态已保存")
+
+    # ---------------- Step 6: 批量发送消息 ----------------
+    # 只有当有实际变动消息时，才调用发送接口
+    if all_messages:
+        # 调用刚才写好的 POST 发送函数
+        send_messages(all_messages)
+
+        # (本地调试用，可以看到发了什么，实际运行在服务器上看log即可)
+        print("-" * 30)
+        print(f"共推送 {len(all_messages)} 条内容")
+    else:
+        print("\n💤 本次执行无重要变动，不发送推送")
+
+    if sub_index is not None and sub_outboxes:
+        send_subscription_messages(sub_index, sub_outboxes)
+
+def run_with_profile(func, output_path: str):
+    """使用 cProfile 包裹运行，按累计耗时排序输出统计 (同时打印前 30 项)"""
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(func)
+    finally:
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream).sort_stats("cumulative")
+        stats.print_stats()
+        try:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(stream.getvalue())
+            log(f"🧪 性能分析结果已写入: {output_path}")
+        except Exception as e:
+            log(f"❌ 写入性能分析结果失败: {e}")
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(30)
+        print(stream.getvalue())
+def build_arg_parser() -> argparse.ArgumentParser:
+    """命令行参数定义 (不带参数运行即为原有的定时监控模式)"""
+    parser = argparse.ArgumentParser(description="PU口袋校园活动自动监听与提醒助手")
+    parser.add_argument("--trace", nargs="?", const=TRACE_FILE, default=None, metavar="FILE",
+                        help=f"记录各阶段与请求耗时，输出 Chrome/Perfetto trace JSON (默认 {TRACE_FILE})")
+    parser.add_argument("--profile", nargs="?", const=PROFILE_FILE, default=None, metavar="FILE",
+                        help=f"使用 cProfile 包裹运行并输出排序后的统计 (默认 {PROFILE_FILE})")
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    query = subparsers.add_parser("query", help="检索本地活动索引 (不发送网络请求)")
+    query.add_argument("text", nargs="*", help="关键词 (空格分隔，全部命中)")
+    query.add_argument("--from", dest="time_from", metavar="TIME", help="起始时间 YYYY-MM-DD[ HH:MM]")
+    query.add_argument("--to", dest="time_to", metavar="TIME", help="截止时间 (不含)")
+    query.add_argument("--by", choices=["join_start", "start_time"], default="join_start",
+                       help="时间范围作用的字段：报名开始 / 活动开始 (默认报名开始)")
+    query.add_argument("--min-credit", type=float, help="最低学分")
+    query.add_argument("--max-credit", type=float, help="最高学分")
+    query.add_argument("--min-pu", type=float, help="最低 PU 银豆")
+    query.add_argument("--max-pu", type=float, help="最高 PU 银豆")
+    query.add_argument("--status", help="状态名，如 报名中")
+    query.add_argument("--source", choices=["tribe", "public"], help="来源")
+    query.add_argument("--limit", type=int, default=20, help="最多返回条数")
+    query.add_argument("--json", action="store_true", help="以 JSON 输出")
+
+    archive = subparsers.add_parser("archive", help="以 NDJSON 流式输出归档的历史活动")
+    archive.add_argument("--since", metavar="TIME", help="归档时间下限 'YYYY-MM-DD HH:MM:SS' (字符串比较，可只写日期)")
+    archive.add_argument("--until", metavar="TIME", help="归档时间上限 (不含)")
+    archive.add_argument("--id", help="只输出指定活动 ID")
+
+    watch = subparsers.add_parser("watch", help="在 joinStartTime 附近高频轮询即将开放报名的活动")
+    watch.add_argument("--horizon", type=float, help=f"监视未来多少分钟内开放的活动 (默认 {WATCH_HORIZON_MIN})")
+    watch.add_argument("--interval", type=float, help=f"单个活动轮询间隔秒数 (默认 {WATCH_POLL_INTERVAL_SEC})")
+    watch.add_argument("--rps", type=float, help=f"全局请求速率上限 (默认 {WATCH_MAX_RPS})")
+
+    events = subparsers.add_parser("events", help="增量输出变更事件日志 (NDJSON)")
+    events.add_argument("--offset", type=int, default=0, help="从该字节偏移开始读取 (上次输出的 next_offset)")
+    events.add_argument("--after", type=int, default=0, help="只输出序号大于该值的事件")
+
+    simulate = subparsers.add_parser("simulate", help="离线回放报名人数历史，比较不同限流阈值 (不发送网络请求)")
+    simulate.add_argument("--detail-counts", default="0,1,2,3,5", help="MAX_LARGE_DETAIL_COUNT 候选值 (逗号分隔)")
+    simulate.add_argument("--batches", default="20,40,80,160,320", help="LARGE_NOTIFY_BATCH 候选值")
+    simulate.add_argument("--capacity-limits", default="200,700,1500", help="LARGE_ACT_CAPACITY_LIMIT 候选值")
+    simulate.add_argument("--duration-limits", default="3,10,30", help="LARGE_ACT_DURATION_DAYS 候选值")
+    simulate.add_argument("--force-large", default="1,0", help="LARGE_ACT_FORCE_ALL 候选值 (1/0)")
+    simulate.add_argument("--interval", type=float, default=0,
+                          help="虚拟时钟的运行间隔 (分钟)，0 表示按历史记录点逐点回放")
+    simulate.add_argument("--synthetic", type=int, default=0, metavar="N", help="改用 N 个合成公共活动的增长曲线")
+    simulate.add_argument("--seed", type=int, default=42, help="[--synthetic] 随机种子")
+    simulate.add_argument("--no-archive", action="store_true", help="只回放主缓存，不读取归档")
+    simulate.add_argument("--sort", choices=["messages", "latency"], default="messages", help="排序依据")
+    simulate.add_argument("--top", type=int, default=20, help="输出前 N 组配置 (当前配置总会输出)")
+    simulate.add_argument("--verify", action="store_true", help="用真实处理器回放当前配置并与模拟结果核对 (不能与 --interval 同用)")
+    simulate.add_argument("--json", action="store_true", help="以 NDJSON 输出全部结果")
+
+    kv = subparsers.add_parser("kv-serve", help="启动内存 KV 服务，供多节点共享缓存与租约 (COORD_BACKEND = \"kv\")")
+    kv.add_argument("--host", default="127.0.0.1", help="监听地址")
+    kv.add_argument("--port", type=int, default=8765, help="监听端口")
+
+    bench = subparsers.add_parser("bench", help="离线性能基准 (不发送网络请求)")
+    bench.add_argument("suite", choices=sorted(BENCH_SUITES), help="基准套件")
+    bench.add_argument("--seed", type=int, default=42, help="随机种子 (结果可复现)")
+    bench.add_argument("--profiles", type=int, default=10000, help="[subscriptions] 合成订阅者数量")
+    bench.add_argument("--activities", type=int, default=500, help="[subscriptions] 合成活动数量")
+    bench.add_argument("--sizes", default="100,1000,5000", help="[pipeline/dedup/json/unified] 公共活动规模列表 (逗号分隔)")
+    return parser
+def main(argv: Optional[List[str]] = None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.command == "simulate" and args.verify and args.interval:
+        # 处理器按历史点逐点回放，只能与不重新采样的模拟结果核对
+        parser.error("simulate --verify 只能用于逐点回放，不能与 --interval 同时使用")
+
+    # 子命令 (不带子命令时执行定时监控)
+    commands = {
+        "query": lambda: run_query(args),
+        "archive": lambda: run_archive_dump(args),
+        "watch": lambda: run_watcher(args),
+        "events": lambda: run_events_dump(args),
+        "kv-serve": lambda: run_kv_server(args),
+        "simulate": lambda: run_simulation(args),
+        "bench": lambda: BENCH_SUITES[args.suite](args),
+    }
+    run = commands.get(args.command, run_monitor)
+
+    trace_path = args.trace or (TRACE_FILE if TRACE_ENABLED else None)
+    if trace_path:
+        start_trace()
+
+    try:
+        if args.profile:
+            run_with_profile(run, args.profile)
         else:
-            print("\n💤 本次执行无重要变动，不发送推送")
+            run()
+    finally:
+        if trace_path:
+            dump_trace(trace_path)
 
+if __name__ == "__main__":
+    try:
+        main()
     except Exception as e:
         import traceback
 